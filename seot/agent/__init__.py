@@ -1,8 +1,9 @@
 import logging
+import sys
+import types
+from importlib import import_module
 
 from . import config, meta
-from .agent import Agent
-from .graph_builder import GraphBuilder
 from .util import configure_logging, log_quit_message, log_startup_message
 from .util import parse_cmd_args
 
@@ -11,8 +12,38 @@ __version__ = meta.__version__
 
 logger = logging.getLogger(__name__)
 
+# Names re-exported from submodules which are imported on first access, so
+# that importing seot.agent (e.g. from setup.py) does not pull in aiohttp,
+# zmq and the like
+_LAZY_EXPORTS = {
+    "Agent": ".agent",
+    "GraphBuilder": ".graph_builder",
+}
+
+
+class _Module(types.ModuleType):
+    # Module-level __getattr__ needs Python 3.7
+    def __getattr__(self, name):
+        if name not in _LAZY_EXPORTS:
+            raise AttributeError("module {0!r} has no attribute {1!r}".format(
+                __name__, name
+            ))
+
+        value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_LAZY_EXPORTS))
+
+
+sys.modules[__name__].__class__ = _Module
+
 
 def main():
+    from .agent import Agent
+    from .graph_builder import GraphBuilder
+
     args = parse_cmd_args()
 
     # Initialize logging
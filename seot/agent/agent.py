@@ -2,6 +2,7 @@ import asyncio
 import copy
 import json
 import logging
+import signal
 
 from aiodns.error import DNSError
 
@@ -12,21 +13,58 @@ import zmq.asyncio
 
 from . import config, meta
 from .graph_builder import GraphBuilder
+from .loop_monitor import LoopMonitor
+from .profiler import ProfileSession
+from .util import fingerprint
 
 logger = logging.getLogger(__name__)
 
 
 class Agent:
-    BASE_URL = None
-
-    def __init__(self):
-        self.__class__.BASE_URL = config.get("cpp.base_url")
-        self.loop = zmq.asyncio.install()
+    # Seconds to wait before retrying a failed long poll
+    LONG_POLL_RETRY_INTERVAL = 5
+
+    def __init__(self, loop=None, settings=None, state=None,
+                 on_job_start=None):
+        """
+        Initialize this agent. By default the process-wide configurations and
+        states are used; pass settings (a validated configuration dict) and
+        state (a state dict) to run several agents in one process. If given,
+        on_job_start is called with the job ID once the graph of a job has
+        started.
+        """
+        self._settings = settings
+        self._state = state
+        self.on_job_start = on_job_start
+        self.base_url = self._get_config("cpp.base_url")
+
+        self.loop = loop
+        if self.loop is None:
+            self.loop = zmq.asyncio.install()
         # UUID of Job -> Graph
         self.jobs = {}
+        self._task = None
+        self._dispatch_task = None
+        # Commands arrive over both heartbeats and long polls; handle them
+        # one at a time so that a kill cannot overtake the matching run
+        self._command_lock = asyncio.Lock(loop=self.loop)
+        self._profile = None
+        self._monitor = None
+        # (fingerprint, report) last acknowledged by the server
+        self._acked_report = None
+
+    def _get_config(self, key):
+        if self._settings is None:
+            return config.get(key)
+        return config.lookup(self._settings, key)
+
+    def _get_state(self, key):
+        if self._state is None:
+            return config.get_state(key)
+        return config.lookup(self._state, key)
 
     async def _request(self, method, endpoint, data=None, content_type=None):
-        url = self.__class__.BASE_URL + endpoint
+        url = self.base_url + endpoint
         headers = {
             "User-Agent": "seot-agent {0}".format(meta.__version__)
         }
@@ -55,6 +93,8 @@ class Agent:
                 ))
             except (ClientTimeoutError, asyncio.TimeoutError):
                 logger.error("Request timed out")
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error("Unexpected error: {0}".format(e))
 
@@ -74,35 +114,143 @@ class Agent:
         logger.info("Rejecting job {0}".format(job_id))
         return await self._request("POST", "/job/{0}/reject".format(job_id))
 
+    def _report(self):
+        return copy.deepcopy({
+            "user_name": self._get_config("agent.user_name"),
+            "longitude": self._get_config("agent.coordinate.longitude"),
+            "latitude": self._get_config("agent.coordinate.latitude"),
+            "nodes": list(GraphBuilder.REGISTERED_NODES.keys()),
+            "facts": self._get_config("facts")
+        })
+
     async def _heartbeat(self):
         logger.debug("Sending heartbeat to SEoT server...")
 
-        try:
-            resp = await self._request("POST", "/heartbeat", data={
-                "user_name": config.get("agent.user_name"),
-                "agent_id": config.get_state("agent_id"),
-                "longitude": config.get("agent.coordinate.longitude"),
-                "latitude": config.get("agent.coordinate.latitude"),
-                "nodes": list(GraphBuilder.REGISTERED_NODES.keys()),
-                "facts": config.get("facts")
-            })
-        except:
-            raise
+        report = self._report()
+        digest = fingerprint(report)
+        data = {
+            "agent_id": self._get_state("agent_id"),
+        }
+
+        if self._acked_report is None or \
+                not self._get_config("cpp.delta_heartbeat"):
+            data.update(report)
+        else:
+            # Only send fields changed since the acknowledged report
+            base, acked = self._acked_report
+            data["base"] = base
+            data.update({key: value for key, value in report.items()
+                         if acked.get(key) != value})
+
+        # An unchanged delta is identified by its base alone
+        if data.get("base") != digest:
+            data["fingerprint"] = digest
+
+        resp = await self._request("POST", "/heartbeat", data=data)
 
         logger.debug("Received response for heartbeat")
 
+        if resp is None:
+            return
+
+        if resp.get("resync"):
+            self._acked_report = None
+            if "base" in data:
+                logger.info("Server requested a full heartbeat")
+                return await self._heartbeat()
+
+        # Servers that do not understand deltas never echo the fingerprint
+        if resp.get("fingerprint") == digest:
+            self._acked_report = (digest, report)
+        else:
+            self._acked_report = None
+
+        await self._handle_command(resp)
+
+    async def _handle_command(self, resp):
         if resp is None:
             pass
 
         elif resp.get("run"):
-            await self._start_job(resp["run"])
+            with await self._command_lock:
+                await self._start_job(resp["run"])
 
         elif resp.get("kill"):
-            await self._stop_job(resp["kill"])
+            with await self._command_lock:
+                await self._stop_job(resp["kill"])
+
+        elif resp.get("profile"):
+            self.start_profile(**resp["profile"])
 
         else:
             logger.debug("Nothing to do")
 
+    async def _long_poll(self, timeout):
+        """
+        Wait up to timeout seconds for a command from the control plane.
+        Returns a tuple of the HTTP status (None on error) and the command.
+        """
+        url = self.base_url + "/dispatch"
+        params = {
+            "agent_id": self._get_state("agent_id"),
+            "timeout": timeout
+        }
+        headers = {
+            "User-Agent": "seot-agent {0}".format(meta.__version__)
+        }
+
+        async with aiohttp.ClientSession(loop=self.loop) as session:
+            try:
+                async with session.get(url, params=params, headers=headers,
+                                       timeout=timeout + 10) as resp:
+                    if resp.status == 200:
+                        return resp.status, await resp.json()
+                    return resp.status, None
+            except (ClientTimeoutError, asyncio.TimeoutError):
+                logger.debug("Long poll timed out")
+                return 204, None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Long poll failed: {0}".format(e))
+                return None, None
+
+    async def _dispatch_loop(self):
+        timeout = self._get_config("cpp.long_poll_timeout")
+
+        while True:
+            status, command = await self._long_poll(timeout)
+
+            if status in (404, 405, 501):
+                logger.info("Server does not support long polling; relying "
+                            "on heartbeat polling")
+                return
+            elif status is None or status >= 400:
+                await asyncio.sleep(self.LONG_POLL_RETRY_INTERVAL,
+                                    loop=self.loop)
+            elif command:
+                try:
+                    await self._handle_command(command)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Failed to handle command: {0}".format(e))
+
+    def _isolation_options(self, job_id):
+        if not self._get_config("job_isolation.enabled"):
+            return {}
+
+        return {
+            "isolate": True,
+            "worker_options": {
+                "name": "job-{0}".format(job_id),
+                "cpu_affinity": self._get_config(
+                    "job_isolation.cpu_affinity"
+                ),
+                "nice": self._get_config("job_isolation.nice")
+            }
+        }
+
     async def _start_job(self, job_id):
         logger.info("Got job offer for job {0}".format(job_id))
 
@@ -119,7 +267,8 @@ class Agent:
         job.pop("job_id", None)
 
         try:
-            graph = GraphBuilder.from_obj(job)
+            options = self._isolation_options(job_id)
+            graph = GraphBuilder.from_obj(job, loop=self.loop, **options)
             await graph.startup()
         except Exception as e:
             logger.warning("Failed to start job {0}: {1}".format(job_id, e))
@@ -128,14 +277,21 @@ class Agent:
             return
 
         self.jobs[job_id] = graph
+        if self._monitor is not None:
+            self._monitor.attribute(graph.nodes(), job_id)
 
         async def _cleanup(graph):
             await graph.cleanup()
             await self._notify_job_stop(job_id)
             self.jobs.pop(job_id, None)
+            if self._monitor is not None:
+                self._monitor.forget(graph.nodes())
 
         await graph.start(done_cb=_cleanup)
 
+        if self.on_job_start is not None:
+            self.on_job_start(job_id)
+
     async def _stop_job(self, job_id):
         graph = self.jobs.get(job_id)
         if not graph:
@@ -146,22 +302,148 @@ class Agent:
             logger.info("Terminating job {0}".format(job_id))
             await graph.stop()
 
+    def _long_polling(self):
+        return self._dispatch_task is not None and \
+            not self._dispatch_task.done()
+
     async def _main(self):
-        sleep_length = config.get("cpp.heartbeat_interval")
+        if self._get_config("cpp.long_poll"):
+            self._dispatch_task = asyncio.ensure_future(self._dispatch_loop(),
+                                                        loop=self.loop)
 
         while True:
             try:
                 await self._heartbeat()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error("Heartbeat failed: {0}".format(e))
-            await asyncio.sleep(sleep_length)
+
+            if self._long_polling():
+                # Commands arrive over the long poll, so heartbeats only
+                # report the agent state. Wake up early on fallback to
+                # resume polling at the normal interval.
+                await asyncio.wait(
+                    [self._dispatch_task], loop=self.loop,
+                    timeout=self._get_config(
+                        "cpp.long_poll_heartbeat_interval"
+                    )
+                )
+            else:
+                await asyncio.sleep(self._get_config("cpp.heartbeat_interval"),
+                                    loop=self.loop)
+
+    def start_profile(self, job_id=None, node=None, mode=None, duration=None):
+        """
+        Profile the agent, a job or a node of a job for a bounded window.
+        A job or a node can only be profiled in sample mode. Returns the
+        ProfileSession, or None if it could not be started.
+        """
+        if self._profile is not None and self._profile.active():
+            logger.warning("A profile session is already running")
+            return None
+
+        nodes = None
+        label = "agent"
+        if job_id is not None:
+            graph = self.jobs.get(job_id)
+            if graph is None:
+                logger.warning("Unknown job {0}".format(job_id))
+                return None
+
+            nodes = graph.nodes()
+            label = "job-{0}".format(job_id)
+            if node is not None:
+                nodes = [n for n in nodes if n.name == node]
+                label += "-" + node
+            if not nodes:
+                logger.warning("No nodes to profile in job {0} (isolated "
+                               "jobs cannot be profiled)".format(job_id))
+                return None
+
+            mode = mode or "sample"
+            if mode != "sample":
+                logger.warning("Profiling a job requires sample mode")
+                return None
+
+        try:
+            self._profile = ProfileSession(
+                mode=mode or self._get_config("profiling.mode") or "cprofile",
+                duration=(duration or
+                          self._get_config("profiling.duration") or 30),
+                nodes=nodes,
+                interval=self._get_config("profiling.interval") or 0.01,
+                output_dir=self._get_config("profiling.output_dir"),
+                label=label,
+                loop=self.loop
+            )
+            self._profile.start()
+        except Exception as e:
+            logger.error("Failed to start profiling: {0}".format(e))
+            self._profile = None
+
+        return self._profile
+
+    def _toggle_profile(self):
+        if self._profile is not None and self._profile.active():
+            self._profile.stop()
+        else:
+            self.start_profile()
+
+    async def start(self):
+        """
+        Start sending heartbeats and polling for commands in the background.
+        """
+        if self._task is not None and not self._task.done():
+            raise RuntimeError("Agent is already running")
+
+        self._task = asyncio.ensure_future(self._main(), loop=self.loop)
 
     def stop(self):
-        if not self._task.cancelled() and not self._task.done():
-            self._task.set_result(None)
+        if self._profile is not None:
+            self._profile.stop()
+
+        if self._monitor is not None:
+            self._monitor.stop()
+
+        if self._dispatch_task is not None:
+            self._dispatch_task.cancel()
+
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def shutdown(self):
+        """
+        Stop polling for commands and wait until it has stopped, then stop
+        all running jobs.
+        """
+        self.stop()
+
+        tasks = [task for task in (self._task, self._dispatch_task)
+                 if task is not None]
+        if tasks:
+            await asyncio.wait(tasks, loop=self.loop)
+
+        for job_id, graph in copy.copy(self.jobs).items():
+            if not graph.running():
+                continue
+
+            logger.info("Terminating job {0}".format(job_id))
+            await graph.stop()
 
     def run(self):
-        self._task = asyncio.ensure_future(self._main(), loop=self.loop)
+        self.loop.run_until_complete(self.start())
+
+        # SIGUSR1 starts an agent-wide profile, or stops the running one
+        self.loop.add_signal_handler(signal.SIGUSR1, self._toggle_profile)
+
+        if self._get_config("loop_monitor.enabled"):
+            self._monitor = LoopMonitor(
+                loop=self.loop,
+                interval=self._get_config("loop_monitor.interval"),
+                threshold=self._get_config("loop_monitor.threshold")
+            )
+            self._monitor.start()
 
         # Run main event loop
         logger.info("Starting main event loop...")
@@ -172,13 +454,6 @@ class Agent:
         finally:
             logger.info("Shutting down...")
 
-            self.stop()
-
-            for job_id, graph in copy.copy(self.jobs).items():
-                if not graph.running():
-                    continue
-
-                logger.info("Terminating job {0}".format(job_id))
-                self.loop.run_until_complete(graph.stop())
+            self.loop.run_until_complete(self.shutdown())
 
         self.loop.close()
@@ -0,0 +1,142 @@
+"""
+Measure the message throughput of a dataflow graph.
+
+Usage: python -m seot.agent.benchmark path/to/graph.yaml [--duration N]
+                                     [--compare fusion|handoff|compact]
+                                     [--trace-memory]
+
+The graph is run once with a feature disabled and once with it enabled, and
+the number of messages processed by sink nodes per second is reported for
+both runs. The compared feature is operator fusion by default, the
+in-process handoff between ZMQ nodes (compared against loopback TCP) with
+--compare handoff, or compact records (compared against dicts, for nodes
+having a compact arg) with --compare compact. With --trace-memory, the peak
+memory allocated by Python during each run is reported as well.
+"""
+import argparse
+import asyncio
+import copy
+import tracemalloc
+from logging import getLogger
+
+import zmq.asyncio
+
+from . import config, metrics, transport
+from .graph_builder import GraphBuilder
+from .sources import BaseSource
+from .util import configure_logging
+
+logger = getLogger(__name__)
+
+
+def _sink_names(graph):
+    return [node.name for node in graph.nodes()
+            if not isinstance(node, BaseSource)]
+
+
+def _set_arg(graph_def, key, value):
+    """
+    Return a copy of graph_def with arg key set to value on every node
+    which has it.
+    """
+    graph_def = copy.deepcopy(graph_def)
+    for node_def in graph_def["nodes"]:
+        if key in node_def.get("args", {}):
+            node_def["args"][key] = value
+
+    return graph_def
+
+
+def run_graph(loop, graph_def, duration, trace_memory=False, **kwargs):
+    """
+    Run the graph defined by graph_def for duration seconds and return the
+    number of messages processed per second by its sinks.
+    """
+    metrics.reset()
+
+    graph = GraphBuilder.from_obj(graph_def, loop=loop, **kwargs)
+    # Node modules are imported while building the graph, which is left out
+    if trace_memory:
+        tracemalloc.start()
+
+    loop.run_until_complete(graph.startup())
+    loop.run_until_complete(graph.start())
+    loop.run_until_complete(asyncio.sleep(duration, loop=loop))
+    loop.run_until_complete(graph.stop())
+    loop.run_until_complete(graph.cleanup())
+
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info("Peak memory: {0:.1f} KiB".format(peak / 1024))
+
+    timings = metrics.snapshot()["timings"]
+    processed = sum(
+        timings.get("node.{0}.process".format(name), {}).get("count", 0)
+        for name in _sink_names(graph)
+    )
+
+    return processed / duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("graph", help="Graph definition file (YAML)")
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="Duration of each run in seconds")
+    parser.add_argument("-c", "--config", help="Configuration file path")
+    parser.add_argument("-s", "--state", help="State file path")
+    parser.add_argument("--compare", choices=("fusion", "handoff", "compact"),
+                        default="fusion", help="Feature to compare")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Report peak memory use (slows down runs)")
+    args = parser.parse_args()
+
+    configure_logging(verbose=False)
+    config.load(args.config, args.state)
+
+    import yaml
+
+    with open(args.graph) as f:
+        graph_def = yaml.load(f)
+
+    loop = zmq.asyncio.install()
+    options = {"trace_memory": args.trace_memory}
+
+    if args.trace_memory:
+        # Keep one-time allocations out of the first measured run
+        run_graph(loop, graph_def, 1.0)
+
+    if args.compare == "fusion":
+        baseline = run_graph(loop, graph_def, args.duration, fuse=False,
+                             **options)
+        logger.info("Unfused: {0:.1f} msg/s".format(baseline))
+
+        result = run_graph(loop, graph_def, args.duration, fuse=True,
+                           **options)
+        logger.info("Fused: {0:.1f} msg/s".format(result))
+    elif args.compare == "handoff":
+        transport.handoff_enabled = False
+        baseline = run_graph(loop, graph_def, args.duration, **options)
+        logger.info("Loopback TCP: {0:.1f} msg/s".format(baseline))
+
+        transport.handoff_enabled = True
+        result = run_graph(loop, graph_def, args.duration, **options)
+        logger.info("In-process handoff: {0:.1f} msg/s".format(result))
+    else:
+        baseline = run_graph(loop, _set_arg(graph_def, "compact", False),
+                             args.duration, **options)
+        logger.info("Dicts: {0:.1f} msg/s".format(baseline))
+
+        result = run_graph(loop, _set_arg(graph_def, "compact", True),
+                           args.duration, **options)
+        logger.info("Compact records: {0:.1f} msg/s".format(result))
+
+    if baseline:
+        logger.info("Speedup: {0:.2f}x".format(result / baseline))
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Out-of-band storage of large binary values
+
+If blobs.enabled is set, sources move binary message values of at least
+blobs.threshold bytes into files under a shared memory directory and put a
+Blob referencing the file in the message instead. A Blob maps its file
+lazily, and it is shared rather than copied when a message is delivered to
+several nodes or deep-copied. The file is removed as soon as the last
+reference to its Blob is dropped.
+
+Blobs only live within the process which created them: dpp.encode() turns
+them back into bytes when a message leaves the process, and sinks storing
+them (e.g. MongoDBSink) copy them back too. Blobs are therefore disabled by
+default; they only pay off when large values fan out to several nodes of a
+process.
+"""
+import atexit
+import collections.abc
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+from contextlib import suppress
+from logging import getLogger
+from pathlib import Path
+
+from . import config, metrics
+
+logger = getLogger(__name__)
+
+DEFAULT_THRESHOLD = 64 * 1024
+
+_store = None
+
+
+def _default_path():
+    shm = Path("/dev/shm")
+    if shm.is_dir():
+        return shm / "seot-blobs"
+
+    return Path(tempfile.gettempdir()) / "seot-blobs"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class Blob:
+    """
+    An immutable binary value stored in a BlobStore.
+    """
+    __slots__ = ("id", "size", "_path", "_mmap", "__weakref__")
+
+    def __init__(self, blob_id, size, path):
+        self.id = blob_id
+        self.size = size
+        self._path = path
+        self._mmap = None
+
+    def __len__(self):
+        return self.size
+
+    def __bytes__(self):
+        return bytes(self.view())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "<Blob {0} ({1} bytes)>".format(self.id, self.size)
+
+    def view(self):
+        """
+        Return a read-only memoryview of the content, mapping the file on
+        first use.
+        """
+        if not self.size:
+            return memoryview(b"")
+
+        if self._mmap is None:
+            with self._path.open("rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return memoryview(self._mmap)
+
+
+class BlobStore:
+    """
+    Stores blobs as files in a per-process directory under path. Directories
+    left behind by processes which are no longer alive are removed when a
+    store is created.
+    """
+    def __init__(self, path=None, threshold=DEFAULT_THRESHOLD):
+        self.root = Path(path) if path else _default_path()
+        self.pid = os.getpid()
+        self.path = self.root / str(self.pid)
+        self.threshold = threshold
+
+        self._count = 0
+        self._bytes = 0
+
+        self._remove_stale()
+        os.makedirs(str(self.path), exist_ok=True)
+        atexit.register(self.close)
+
+    def _remove_stale(self):
+        if not self.root.is_dir():
+            return
+
+        for child in self.root.iterdir():
+            if child.name.isdigit() and not _pid_alive(int(child.name)):
+                logger.info("Removing stale blobs at {0}".format(child))
+                shutil.rmtree(str(child), ignore_errors=True)
+
+    def put(self, data):
+        """
+        Store data and return a Blob referencing it.
+        """
+        blob_id = uuid.uuid4().hex
+        path = self.path / blob_id
+
+        with path.open("wb") as f:
+            f.write(data)
+
+        blob = Blob(blob_id, len(data), path)
+        weakref.finalize(blob, self._release, path, blob.size)
+
+        self._count += 1
+        self._bytes += blob.size
+        metrics.incr("blobs.created")
+        self._update_gauges()
+
+        return blob
+
+    def _release(self, path, size):
+        # The mapping (if any) is unmapped when the mmap object is collected
+        with suppress(FileNotFoundError):
+            path.unlink()
+
+        self._count -= 1
+        self._bytes -= size
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge("blobs.count", self._count)
+        metrics.set_gauge("blobs.bytes", self._bytes)
+
+    def externalize(self, data):
+        """
+        Replace binary values of the dict data which are at least threshold
+        bytes long with Blobs, in place.
+        """
+        for key, value in data.items():
+            if type(value) is bytes and len(value) >= self.threshold:
+                data[key] = self.put(value)
+
+    def close(self):
+        """
+        Remove the directory of this store. Blobs still referenced become
+        unreadable unless they are already mapped.
+        """
+        # Forked children inherit the store of their parent
+        if os.getpid() != self.pid:
+            return
+
+        shutil.rmtree(str(self.path), ignore_errors=True)
+
+
+def get_store():
+    """
+    Return the blob store of this process, or None if blobs are disabled.
+    """
+    global _store
+
+    # A forked child must not share the directory of its parent
+    if _store is None or _store.pid != os.getpid():
+        options = config.get("blobs") or {}
+        if not options.get("enabled", False):
+            return None
+
+        _store = BlobStore(options.get("path"),
+                           options.get("threshold", DEFAULT_THRESHOLD))
+
+    return _store
+
+
+def resolve(value):
+    """
+    Return a bytes-like object for value if it is a Blob, or value itself
+    otherwise.
+    """
+    if isinstance(value, Blob):
+        return value.view()
+
+    return value
+
+
+def materialize(data):
+    """
+    Return a copy of data whose mappings (as dicts), lists and tuples are
+    copied and whose Blobs are replaced with bytes.
+    """
+    if isinstance(data, Blob):
+        return bytes(data)
+    elif isinstance(data, collections.abc.Mapping):
+        return {key: materialize(value) for key, value in data.items()}
+    elif isinstance(data, (list, tuple)):
+        return type(data)(map(materialize, data))
+    else:
+        return data
@@ -5,13 +5,12 @@ import platform
 import shutil
 import socket
 import sys
+import threading
 import uuid
 from pathlib import Path
 from urllib.parse import urlparse
 
-from schema import Optional, Schema, SchemaError
-
-import yaml
+from schema import Optional, Or, Schema, SchemaError
 
 from . import meta
 
@@ -25,6 +24,8 @@ else:
 logger = logging.getLogger(__name__)
 _config = {}
 _state = {}
+_agent_meta = None
+_state_lock = threading.Lock()
 
 _CONFIG_SCHEMA = Schema({
     "agent": {
@@ -36,18 +37,54 @@ _CONFIG_SCHEMA = Schema({
     },
     "cpp": {
         Optional("heartbeat_interval", default=60): int,
-        Optional("base_url", default="http://localhost:8888/api"): str
+        Optional("base_url", default="http://localhost:8888/api"): str,
+        Optional("long_poll", default=True): bool,
+        Optional("long_poll_timeout", default=30): int,
+        Optional("long_poll_heartbeat_interval", default=300): int,
+        Optional("delta_heartbeat", default=True): bool
+    },
+    Optional("node_blacklist"): [str],
+    Optional("node_probe_ttl", default=86400): int,
+    Optional("job_isolation"): {
+        Optional("enabled"): bool,
+        Optional("cpu_affinity"): [int],
+        Optional("nice"): int
+    },
+    Optional("loop_monitor", default={"enabled": True, "interval": 0.1,
+                                      "threshold": 0.1}): {
+        Optional("enabled", default=True): bool,
+        Optional("interval", default=0.1): Or(float, int),
+        Optional("threshold", default=0.1): Or(float, int)
+    },
+    Optional("blobs"): {
+        Optional("enabled"): bool,
+        Optional("threshold"): int,
+        Optional("path"): str
     },
-    Optional("node_blacklist"): [str]
+    Optional("tracing"): {
+        Optional("sample_rate"): Or(float, int)
+    },
+    Optional("profiling"): {
+        Optional("output_dir"): str,
+        Optional("duration"): int,
+        Optional("mode"): str,
+        Optional("interval"): Or(float, int)
+    }
 })
 
 _STATE_SCHEMA = Schema({
     "version": str,
-    "agent_id": str
+    "agent_id": str,
+    Optional("node_probes"): {
+        "version": str,
+        "probed_at": float,
+        "results": {Optional(str): bool}
+    }
 })
 
 
-def _get(config, key=None):
+def lookup(config, key=None):
+    """ Look up a dotted key in a configuration or state dict """
     if key is None:
         return config
 
@@ -64,13 +101,55 @@ def _get(config, key=None):
 
 def get(key=None):
     """ Get a configuration value """
-    return _get(_config, key)
+    return lookup(_config, key)
+
+
+def validate(obj):
+    """ Validate a configuration dict and fill in default values """
+    return _CONFIG_SCHEMA.validate(obj)
+
+
+def get_agent_meta():
+    """ Get the agent-level metadata attached to emitted messages """
+    global _agent_meta
+
+    if _agent_meta is None:
+        _agent_meta = {
+            "agent_id": get_state("agent_id"),
+            "longitude": get("agent.coordinate.longitude"),
+            "latitude": get("agent.coordinate.latitude")
+        }
+
+    return _agent_meta
+
+
+def snapshot():
+    """ Return the current configurations and states """
+    return {"config": _config, "state": _state}
+
+
+def restore(snap):
+    """ Restore configurations and states returned by snapshot() """
+    global _config, _state, _agent_meta
+
+    _config = snap["config"]
+    _state = snap["state"]
+    _agent_meta = None
 
 
 def save_state():
     """ Persis current state """
-    with STATE_FILE_PATH.open("w") as f:
-        f.write(yaml.dump(_state))
+    import yaml
+
+    with _state_lock:
+        with STATE_FILE_PATH.open("w") as f:
+            f.write(yaml.dump(_state))
+
+
+def set_state(key, value):
+    """ Set a top-level state value and persist it """
+    _state[key] = value
+    save_state()
 
 
 def _init_state():
@@ -89,7 +168,7 @@ def _init_state():
 
 def get_state(key=None):
     """ Get a state value """
-    return _get(_state, key)
+    return lookup(_state, key)
 
 
 def _init_config():
@@ -113,7 +192,11 @@ def _init_config():
 
 def load(conf_path=None, state_path=None):
     """ Load configurations from files """
-    global _config, _state, CONFIG_FILE_PATH, STATE_FILE_PATH
+    global _config, _state, _agent_meta, CONFIG_FILE_PATH, STATE_FILE_PATH
+
+    import yaml
+
+    _agent_meta = None
 
     if conf_path:
         CONFIG_FILE_PATH = Path(conf_path)
@@ -0,0 +1,248 @@
+"""
+A local stand-in for the SEoT control plane (cpp) API, for testing agents
+without live infrastructure.
+
+Usage: python -m seot.agent.cpp_standin [--host HOST] [--port PORT]
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict, deque
+from logging import getLogger
+
+from aiohttp import web
+
+from .util import configure_logging, fingerprint
+
+logger = getLogger(__name__)
+
+
+class CPPStandin:
+    """
+    Implements the subset of the cpp API used by Agent. Jobs are queued with
+    submit() and kill(), and handed out through heartbeat responses or the
+    long-poll dispatch endpoint. Heartbeat traffic is accounted in
+    self.stats.
+    """
+    def __init__(self, host="127.0.0.1", port=8888, long_poll=True,
+                 delta_heartbeat=True, loop=None):
+        self.host = host
+        self.port = port
+        self.long_poll = long_poll
+        self.delta_heartbeat = delta_heartbeat
+
+        self.loop = loop
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        # Job ID -> job definition
+        self.jobs = {}
+        # Agent ID -> last reported state
+        self.agents = {}
+        # Agent ID -> fingerprint of the last reported state
+        self._fingerprints = {}
+        # Agent ID -> pending commands
+        self._commands = defaultdict(deque)
+        self._waiters = {}
+        # List of (timestamp, event, agent ID or job ID) tuples
+        self.events = []
+        self.stats = {
+            "heartbeats": 0,
+            "bytes": 0,
+            "full": 0,
+            "delta": 0,
+            "resync": 0
+        }
+
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_post("/api/heartbeat", self._heartbeat)
+        self.app.router.add_get("/api/dispatch", self._dispatch)
+        self.app.router.add_get("/api/job/{job_id}", self._get_job)
+        for action in ("accept", "reject", "stop"):
+            self.app.router.add_post("/api/job/{job_id}/" + action,
+                                     self._job_event(action))
+
+        self._handler = None
+        self._server = None
+
+    @property
+    def base_url(self):
+        return "http://{0}:{1}/api".format(self.host, self.port)
+
+    def _record(self, event, subject):
+        self.events.append((time.time(), event, subject))
+
+    def _push(self, agent_id, command):
+        self._commands[agent_id].append(command)
+
+        waiter = self._waiters.pop(agent_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def submit(self, agent_id, job_def):
+        """
+        Queue a job for an agent and return its job ID.
+        """
+        job_id = str(uuid.uuid4())
+        self.jobs[job_id] = job_def
+        self._record("submit", job_id)
+        self._push(agent_id, {"run": job_id})
+
+        return job_id
+
+    def kill(self, agent_id, job_id):
+        """
+        Ask an agent to stop a job.
+        """
+        self._record("kill", job_id)
+        self._push(agent_id, {"kill": job_id})
+
+    def profile(self, agent_id, **options):
+        """
+        Ask an agent to start a profile session. Options are passed to
+        Agent.start_profile.
+        """
+        self._record("profile", agent_id)
+        self._push(agent_id, {"profile": options})
+
+    def _pop_command(self, agent_id):
+        commands = self._commands.get(agent_id)
+        if commands:
+            command = commands.popleft()
+            self._record("dispatch", agent_id)
+            return command
+        return None
+
+    async def _heartbeat(self, request):
+        raw = await request.read()
+        body = json.loads(raw.decode("utf-8"))
+        agent_id = body.pop("agent_id", None)
+
+        self.stats["heartbeats"] += 1
+        self.stats["bytes"] += len(raw)
+        self._record("heartbeat", agent_id)
+
+        base = body.pop("base", None)
+        digest = body.pop("fingerprint", base)
+
+        if not self.delta_heartbeat:
+            self.stats["full"] += 1
+            self.agents[agent_id] = body
+            return web.json_response(self._pop_command(agent_id) or {})
+
+        if base is None:
+            self.stats["full"] += 1
+            state = body
+        else:
+            self.stats["delta"] += 1
+            if self._fingerprints.get(agent_id) != base:
+                self.stats["resync"] += 1
+                return web.json_response({"resync": True})
+            state = dict(self.agents[agent_id], **body)
+
+        if digest != fingerprint(state):
+            self.stats["resync"] += 1
+            return web.json_response({"resync": True})
+
+        self.agents[agent_id] = state
+        self._fingerprints[agent_id] = digest
+
+        resp = self._pop_command(agent_id) or {}
+        resp["fingerprint"] = digest
+
+        return web.json_response(resp)
+
+    async def _dispatch(self, request):
+        if not self.long_poll:
+            return web.Response(status=404)
+
+        agent_id = request.GET.get("agent_id")
+        timeout = float(request.GET.get("timeout", 30))
+
+        command = self._pop_command(agent_id)
+        if command is None:
+            waiter = self.loop.create_future()
+            self._waiters[agent_id] = waiter
+            try:
+                await asyncio.wait_for(waiter, timeout, loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if self._waiters.get(agent_id) is waiter:
+                    del self._waiters[agent_id]
+
+            command = self._pop_command(agent_id)
+
+        if command is None:
+            return web.Response(status=204)
+        return web.json_response(command)
+
+    async def _get_job(self, request):
+        job_id = request.match_info["job_id"]
+        if job_id not in self.jobs:
+            return web.Response(status=404)
+
+        self._record("get", job_id)
+        job = dict(self.jobs[job_id], job_id=job_id)
+
+        return web.Response(text=json.dumps(job),
+                            content_type="application/json")
+
+    def _job_event(self, action):
+        async def _handler(request):
+            self._record(action, request.match_info["job_id"])
+            return web.json_response({})
+
+        return _handler
+
+    async def start(self):
+        self._handler = self.app.make_handler()
+        self._server = await self.loop.create_server(self._handler,
+                                                     self.host, self.port)
+        logger.info("cpp stand-in listening at {0}".format(self.base_url))
+
+    async def stop(self):
+        for waiter in self._waiters.values():
+            waiter.cancel()
+
+        self._server.close()
+        await self._server.wait_closed()
+        await self.app.shutdown()
+        await self._handler.finish_connections(1.0)
+        await self.app.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--no-long-poll", action="store_true",
+                        help="Respond to long polls with 404")
+    parser.add_argument("--no-delta-heartbeat", action="store_true",
+                        help="Do not acknowledge delta heartbeats")
+    args = parser.parse_args()
+
+    configure_logging(verbose=True)
+
+    loop = asyncio.get_event_loop()
+    server = CPPStandin(args.host, args.port,
+                        long_poll=not args.no_long_poll,
+                        delta_heartbeat=not args.no_delta_heartbeat,
+                        loop=loop)
+    loop.run_until_complete(server.start())
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+        logger.info("Heartbeat stats: {0}".format(server.stats))
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
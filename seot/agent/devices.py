@@ -0,0 +1,344 @@
+"""
+Shared readers of hardware devices
+
+Sources reading the same device (e.g. a Sense HAT or a camera) in several
+jobs subscribe to one DeviceReader instead of opening the device each. The
+reader opens the device when its first subscriber arrives, polls it at the
+shortest interval requested by any subscriber, hands every reading to the
+subscribers whose own interval is due, and closes the device when the last
+subscriber leaves. Readings are shared, not copied, so subscribers must
+build their own messages from them.
+
+Sharing is per process: jobs isolated in worker processes open their own
+devices.
+"""
+import asyncio
+import threading
+import weakref
+from collections import deque
+from logging import getLogger
+
+from . import metrics
+from .scheduler import get_scheduler
+
+logger = getLogger(__name__)
+
+_hubs = weakref.WeakKeyDictionary()
+# Guards _hubs and the readers and closing tasks of hubs, which
+# open_devices() reads from the node probing thread
+_lock = threading.Lock()
+# Keys of devices held by another process (see hold_elsewhere)
+_held_elsewhere = frozenset()
+
+
+def get_hub(loop):
+    """ Return the DeviceHub of an event loop, creating it if needed """
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = DeviceHub(loop)
+        with _lock:
+            _hubs[loop] = hub
+
+    return hub
+
+
+def open_devices():
+    """
+    Return the keys of devices open (or closing) in any event loop of this
+    process. Safe to call from any thread.
+    """
+    keys = set()
+    with _lock:
+        for hub in _hubs.values():
+            keys.update(hub._readers)
+            keys.update(hub._closing)
+
+    return keys
+
+
+def hold_elsewhere(keys):
+    """
+    Mark the devices identified by keys as held by another process, e.g. by
+    the agent which runs this process to probe node types
+    """
+    global _held_elsewhere
+    _held_elsewhere = frozenset(keys)
+
+
+def in_use(key):
+    """
+    Return whether the device identified by key is open in this process or
+    held by another one
+    """
+    return key in _held_elsewhere or key in open_devices()
+
+
+class Subscription:
+    """
+    A subscriber of a DeviceReader, receiving one reading every interval
+    seconds
+    """
+    def __init__(self, reader, interval, name=None, queue_size=1):
+        self.reader = reader
+        self.interval = interval
+        self.name = name
+        # Number of device reads per delivered reading
+        self.every = 1
+
+        self._countdown = 0
+        self._queue = deque(maxlen=queue_size)
+        self._waiter = None
+        self._error = None
+        self._dropped_metric = None
+        if name is not None:
+            self._dropped_metric = "node.{0}.dropped".format(name)
+
+    def _deliver(self, reading):
+        self._countdown -= 1
+        if self._countdown > 0:
+            return
+        self._countdown = self.every
+
+        if reading is None:
+            return
+
+        # Keep the latest readings if the subscriber falls behind
+        if len(self._queue) == self._queue.maxlen and \
+                self._dropped_metric is not None:
+            metrics.incr(self._dropped_metric)
+        self._queue.append(reading)
+        self._wake()
+
+    def _fail(self, error):
+        self._error = error
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self):
+        """
+        Wait for the next reading and return it. Raises the error of the
+        reader if the device failed.
+        """
+        while not self._queue:
+            if self._error is not None:
+                raise self._error
+
+            self._waiter = self.reader.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        return self._queue.popleft()
+
+    def close(self):
+        """
+        Unsubscribe from the reader, closing the device if this was its last
+        subscriber.
+        """
+        self.reader._unsubscribe(self)
+
+
+class DeviceReader:
+    """
+    Polls a device on behalf of its subscribers. Argument open_device is
+    called in an executor and returns a handle passed to coroutine
+    read_device, which returns a reading (or None to skip it), and to
+    close_device, which is also called in an executor.
+    """
+    def __init__(self, hub, key, open_device, read_device, close_device=None,
+                 options=None, phase=0, jitter=0):
+        self.hub = hub
+        self.loop = hub.loop
+        self.key = key
+        self.options = options
+        self.phase = phase
+        self.jitter = jitter
+        # Interval at which the device is polled
+        self.period = None
+        self.subscriptions = []
+
+        self._open_device = open_device
+        self._read_device = read_device
+        self._close_device = close_device
+        self._task = None
+        self._rescheduled = None
+        self._reads_metric = "devices.{0}.reads".format(key)
+        self._subscribers_metric = "devices.{0}.subscribers".format(key)
+
+    def subscribe(self, interval, name=None, queue_size=1):
+        subscription = Subscription(self, interval, name, queue_size)
+        self.subscriptions.append(subscription)
+        self._update()
+
+        if self._task is None:
+            previous = self.hub._closing.get(self.key)
+            self._task = asyncio.ensure_future(self._run(previous),
+                                               loop=self.loop)
+
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        if subscription not in self.subscriptions:
+            return
+
+        self.subscriptions.remove(subscription)
+        if self.subscriptions:
+            self._update()
+            return
+
+        metrics.set_gauge(self._subscribers_metric, 0)
+        self._detach()
+        self._task.cancel()
+
+    def _detach(self):
+        """ Stop handing out this reader to new subscribers """
+        if self.hub._readers.get(self.key) is not self:
+            return
+
+        # A reader opened for a new subscriber waits until this one has
+        # closed the device
+        task = self._task
+        with _lock:
+            del self.hub._readers[self.key]
+            self.hub._closing[self.key] = task
+
+        def _closed(_):
+            with _lock:
+                if self.hub._closing.get(self.key) is task:
+                    del self.hub._closing[self.key]
+
+        task.add_done_callback(_closed)
+
+    def _update(self):
+        metrics.set_gauge(self._subscribers_metric, len(self.subscriptions))
+
+        period = min(subscription.interval
+                     for subscription in self.subscriptions)
+
+        # Intervals are rounded to a multiple of the period
+        for subscription in self.subscriptions:
+            subscription.every = 1
+            if period:
+                subscription.every = max(1, round(subscription.interval /
+                                                  period))
+            subscription._countdown = min(subscription._countdown,
+                                          subscription.every)
+
+        if period != self.period:
+            logger.debug("Polling device {0} every {1} seconds".format(
+                self.key, period
+            ))
+            self.period = period
+            if self._rescheduled is not None and \
+                    not self._rescheduled.done():
+                self._rescheduled.set_result(None)
+
+    async def _read(self, handle):
+        reading = await self._read_device(handle)
+        metrics.incr(self._reads_metric)
+
+        for subscription in list(self.subscriptions):
+            subscription._deliver(reading)
+
+    async def _poll(self, handle):
+        read_now = True
+        while True:
+            period = self.period
+            if not period:
+                await self._read(handle)
+                await asyncio.sleep(0, loop=self.loop)
+                continue
+
+            self._rescheduled = self.loop.create_future()
+            ticker = get_scheduler(self.loop).subscribe(
+                period, phase=self.phase, jitter=self.jitter,
+                name="device.{0}".format(self.key)
+            )
+            tick = None
+            try:
+                while not self._rescheduled.done():
+                    if read_now:
+                        await self._read(handle)
+                    read_now = True
+
+                    tick = asyncio.ensure_future(ticker.wait(),
+                                                 loop=self.loop)
+                    await asyncio.wait([tick, self._rescheduled],
+                                       loop=self.loop,
+                                       return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if tick is not None:
+                    tick.cancel()
+                ticker.cancel()
+
+            # Read at once for a new subscriber asking for a shorter
+            # interval, otherwise wait for the first tick of the new period
+            read_now = not self.period or self.period < period
+
+    async def _run(self, previous):
+        handle = None
+        try:
+            if previous is not None:
+                await asyncio.wait([previous], loop=self.loop)
+
+            logger.info("Opening device {0}".format(self.key))
+            handle = await self.loop.run_in_executor(None, self._open_device)
+            await self._poll(handle)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Device {0} failed: {1}".format(self.key, e))
+            self._detach()
+            for subscription in self.subscriptions:
+                subscription._fail(e)
+        finally:
+            if handle is not None:
+                logger.info("Closing device {0}".format(self.key))
+                if self._close_device is not None:
+                    await self.loop.run_in_executor(None, self._close_device,
+                                                    handle)
+
+
+class DeviceHub:
+    """
+    Keeps one DeviceReader per device key
+    """
+    def __init__(self, loop):
+        self.loop = loop
+
+        # Device key -> DeviceReader
+        self._readers = {}
+        # Device key -> task of a reader closing the device
+        self._closing = {}
+
+    def readers(self):
+        return list(self._readers.values())
+
+    def subscribe(self, key, open_device, read_device, close_device=None,
+                  interval=1, phase=0, jitter=0, options=None, name=None,
+                  queue_size=1):
+        """
+        Subscribe to readings of the device identified by key every interval
+        seconds, opening the device if it has no reader yet. The callables,
+        options, phase and jitter of the first subscriber are used to open
+        and poll the device; a later subscriber whose options differ gets
+        readings made with those options (a device can only be opened once).
+        At most queue_size readings are kept for a subscriber which falls
+        behind.
+        """
+        reader = self._readers.get(key)
+        if reader is None:
+            reader = DeviceReader(self, key, open_device, read_device,
+                                  close_device, options, phase, jitter)
+            with _lock:
+                self._readers[key] = reader
+        elif options != reader.options:
+            logger.warning("Device {0} is already open with options {1}; "
+                           "ignoring options {2} of {3}".format(
+                               key, reader.options, options, name))
+
+        return reader.subscribe(interval, name, queue_size)
@@ -0,0 +1,185 @@
+"""
+Check job dispatch of an agent against a local cpp stand-in.
+
+Usage: python -m seot.agent.dispatch_check [-g graph.yaml]
+
+An Agent is run against a CPPStandin twice. With long polling, a submitted
+job must start and stop well within the heartbeat interval, and heartbeats
+must slow down to cpp.long_poll_heartbeat_interval. Against a server
+without long polling, the agent must fall back to heartbeat polling and
+still run the job. Exits with a non-zero status when a check fails.
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import sys
+import tempfile
+from logging import getLogger
+from pathlib import Path
+
+from . import config
+from .agent import Agent
+from .cpp_standin import CPPStandin
+from .graph_builder import GraphBuilder
+from .simulator import DEFAULT_JOB
+from .util import configure_logging
+
+logger = getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 2
+LONG_POLL_HEARTBEAT_INTERVAL = 60
+# Seconds within which a job must start or stop over the long poll
+DISPATCH_TIMEOUT = 1.0
+
+
+async def _wait_for(predicate, timeout, loop):
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.05, loop=loop)
+
+    return True
+
+
+def _settings(base_url):
+    return config.validate({
+        "agent": {
+            "user_name": "dispatch-check",
+            "coordinate": {
+                "longitude": 0.0,
+                "latitude": 0.0
+            }
+        },
+        "cpp": {
+            "base_url": base_url,
+            "heartbeat_interval": HEARTBEAT_INTERVAL,
+            "long_poll_heartbeat_interval": LONG_POLL_HEARTBEAT_INTERVAL,
+            "long_poll_timeout": 5
+        }
+    })
+
+
+async def check_dispatch(job_def, long_poll, port, loop):
+    """
+    Submit and kill a job through a stand-in with or without long polling
+    support, and return a list of failed checks.
+    """
+    mode = "long poll" if long_poll else "fallback"
+    errors = []
+
+    server = CPPStandin(port=port, long_poll=long_poll, loop=loop)
+    await server.start()
+
+    # Job ID -> time the graph of the job started
+    started = {}
+
+    def _on_job_start(job_id):
+        started[job_id] = loop.time()
+
+    agent = Agent(loop=loop, settings=_settings(server.base_url),
+                  state={"agent_id": "dispatch-check"},
+                  on_job_start=_on_job_start)
+    await agent.start()
+
+    try:
+        # Let the first heartbeat and the long poll go out
+        await asyncio.sleep(0.5, loop=loop)
+        heartbeats = server.stats["heartbeats"]
+
+        # Without long polling, commands wait for the next heartbeat
+        timeout = DISPATCH_TIMEOUT if long_poll else \
+            HEARTBEAT_INTERVAL + DISPATCH_TIMEOUT
+
+        submitted_at = loop.time()
+        job_id = server.submit("dispatch-check", copy.deepcopy(job_def))
+        if await _wait_for(lambda: job_id in started, timeout, loop):
+            logger.info("{0}: job started in {1:.0f}ms".format(
+                mode, (started[job_id] - submitted_at) * 1000
+            ))
+        else:
+            errors.append("{0}: job did not start within {1}s".format(
+                mode, timeout
+            ))
+
+        server.kill("dispatch-check", job_id)
+        if not await _wait_for(lambda: job_id not in agent.jobs, timeout,
+                               loop):
+            errors.append("{0}: job did not stop within {1}s".format(
+                mode, timeout
+            ))
+
+        # Watch for a whole heartbeat interval
+        await asyncio.sleep(max(0.0, submitted_at + HEARTBEAT_INTERVAL -
+                                loop.time()), loop=loop)
+        heartbeats = server.stats["heartbeats"] - heartbeats
+        if long_poll and heartbeats:
+            errors.append("{0}: {1} heartbeats were sent while long "
+                          "polling".format(mode, heartbeats))
+        if not long_poll and not heartbeats:
+            errors.append("{0}: no heartbeats were sent after falling back "
+                          "to polling".format(mode))
+    finally:
+        await agent.shutdown()
+        await server.stop()
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--graph",
+                        help="Job definition file (YAML) to dispatch")
+    parser.add_argument("-p", "--port", type=int, default=18889,
+                        help="Port of the cpp stand-in")
+    parser.add_argument("-c", "--config",
+                        help="Configuration file path (default: built-in "
+                             "settings)")
+    parser.add_argument("-s", "--state",
+                        help="State file path (used with --config)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log output of the agent")
+    args = parser.parse_args()
+
+    configure_logging(args.verbose)
+    if not args.verbose:
+        logging.getLogger("seot.agent").setLevel(logging.WARNING)
+        logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    if args.config is not None:
+        config.load(args.config, args.state)
+    else:
+        # Run without configuration files, e.g. in CI
+        config.STATE_FILE_PATH = Path(tempfile.mkdtemp()) / "state.yml"
+        config.restore({"config": _settings("http://127.0.0.1:{0}".format(
+            args.port
+        )), "state": {}})
+    GraphBuilder.load_node_classes()
+
+    job_def = DEFAULT_JOB
+    if args.graph is not None:
+        import yaml
+
+        with open(args.graph) as f:
+            job_def = yaml.load(f)
+
+    loop = asyncio.get_event_loop()
+
+    errors = []
+    for long_poll in (True, False):
+        errors += loop.run_until_complete(
+            check_dispatch(job_def, long_poll, args.port, loop)
+        )
+
+    loop.close()
+
+    for error in errors:
+        print("Check failed: " + error)
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
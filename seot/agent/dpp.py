@@ -3,15 +3,36 @@ import json
 
 import msgpack
 
-from pygments import formatters, highlight, lexers
+from . import records
+from .blobs import Blob
+
+
+def _encode_extension(obj):
+    if isinstance(obj, records.Record):
+        return obj.to_list()
+    if isinstance(obj, Blob):
+        # Blobs are local to this process, so their content is sent instead.
+        # Older msgpack versions cannot pack a memoryview.
+        return bytes(obj.view())
+
+    raise TypeError("Cannot serialize {0!r}".format(obj))
 
 
 def encode(data):
-    return msgpack.packb(data, use_bin_type=True)
+    return msgpack.packb(data, use_bin_type=True, default=_encode_extension)
 
 
-def decode(data):
-    return msgpack.unpackb(data, encoding="utf-8")
+def decode(data, schema=None):
+    """
+    Decode a message. If schema (a record type) is given, messages encoded
+    from records of that type are decoded into records.
+    """
+    decoded = msgpack.unpackb(data, encoding="utf-8")
+
+    if schema is not None and isinstance(decoded, list):
+        return records.decode(decoded, schema)
+
+    return decoded
 
 
 def _sanitize(data):
@@ -19,6 +40,8 @@ def _sanitize(data):
         return data
     if isinstance(data, bytes):
         return "<binary data ({0} bytes)>".format(len(data))
+    elif isinstance(data, Blob):
+        return "<blob ({0} bytes)>".format(len(data))
     elif isinstance(data, collections.Mapping):
         return dict(map(_sanitize, data.items()))
     elif isinstance(data, collections.Iterable):
@@ -28,6 +51,9 @@ def _sanitize(data):
 
 
 def format(data):
+    # pygments is only needed for debug output, so import it lazily
+    from pygments import formatters, highlight, lexers
+
     formatted_json = json.dumps(_sanitize(data), indent=4)
     colorful_json = highlight(formatted_json, lexers.JsonLexer(),
                               formatters.TerminalFormatter())
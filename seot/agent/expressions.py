@@ -0,0 +1,191 @@
+"""
+A restricted expression language over message fields
+
+Expressions use a subset of Python expression syntax: literals, arithmetic,
+comparisons (including in and not in), and, or, not, conditional expressions
+and calls to the functions in FUNCTIONS. A bare name refers to a message
+field and a dotted name to a nested field (e.g. meta.timestamp); missing
+fields evaluate to None. Expressions are validated and compiled into plain
+Python functions once, so evaluating one costs about as much as calling a
+lambda.
+"""
+import ast
+
+FUNCTIONS = {
+    "abs": abs,
+    "bool": bool,
+    "float": float,
+    "int": int,
+    "len": len,
+    "max": max,
+    "min": min,
+    "round": round,
+    "str": str,
+}
+
+_ALLOWED_NODES = tuple(getattr(ast, name) for name in (
+    "Expression", "BoolOp", "And", "Or", "UnaryOp", "Not", "UAdd", "USub",
+    "BinOp", "Add", "Sub", "Mult", "Div", "FloorDiv", "Mod",
+    "Compare", "Eq", "NotEq", "Lt", "LtE", "Gt", "GtE", "In", "NotIn", "Is",
+    "IsNot", "IfExp", "Call", "Name", "Attribute", "Load", "List", "Tuple",
+    "Num", "Str", "Bytes", "NameConstant", "Constant"
+) if hasattr(ast, name))
+
+# Name of the argument holding the message in compiled functions
+_DATA = "_data"
+
+
+class ExpressionError(ValueError):
+    """
+    Raised when an expression is malformed or uses disallowed syntax
+    """
+    pass
+
+
+def _get(data, path):
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, TypeError, IndexError):
+            return None
+
+    return data
+
+
+def _field_path(node):
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.append(node.attr)
+        node = node.value
+
+    if not isinstance(node, ast.Name):
+        raise ExpressionError("Attributes are only allowed on field names")
+
+    path.append(node.id)
+    path.reverse()
+
+    return path
+
+
+class _Rewriter(ast.NodeTransformer):
+    """ Turns field references into lookups in the message """
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or \
+                node.func.id not in FUNCTIONS:
+            raise ExpressionError("Only calls to {0} are allowed".format(
+                ", ".join(sorted(FUNCTIONS))
+            ))
+        if node.keywords:
+            raise ExpressionError("Keyword arguments are not allowed")
+
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def _lookup(self, node):
+        path = _field_path(node)
+        data = ast.Name(id=_DATA, ctx=ast.Load())
+
+        if len(path) == 1:
+            # Single-level fields are the common case; dict.get is faster
+            lookup = ast.Call(
+                func=ast.Attribute(value=data, attr="get", ctx=ast.Load()),
+                args=[ast.Str(s=path[0])], keywords=[]
+            )
+        else:
+            lookup = ast.Call(
+                func=ast.Name(id="_get", ctx=ast.Load()),
+                args=[data, ast.Tuple(elts=[ast.Str(s=key) for key in path],
+                                      ctx=ast.Load())],
+                keywords=[]
+            )
+
+        return ast.copy_location(lookup, node)
+
+    def visit_Name(self, node):
+        return self._lookup(node)
+
+    def visit_Attribute(self, node):
+        return self._lookup(node)
+
+
+def _parse(source):
+    if not isinstance(source, str):
+        raise ExpressionError("Expression must be a string: {0!r}".format(
+            source
+        ))
+
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError("Invalid expression {0!r}: {1}".format(
+            source, e.msg
+        ))
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ExpressionError("{0} is not allowed in expression {1!r}"
+                                  .format(type(node).__name__, source))
+
+    return _Rewriter().visit(tree).body
+
+
+def _make_function(body, source):
+    # Python 3.8 added posonlyargs to ast.arguments
+    arguments = ast.arguments(args=[ast.arg(arg=_DATA, annotation=None)],
+                              vararg=None, kwonlyargs=[], kw_defaults=[],
+                              kwarg=None, defaults=[])
+    if "posonlyargs" in ast.arguments._fields:
+        arguments.posonlyargs = []
+
+    tree = ast.Expression(body=ast.Lambda(args=arguments, body=body))
+    ast.fix_missing_locations(tree)
+
+    namespace = dict(FUNCTIONS, _get=_get, __builtins__={})
+    code = compile(tree, "<expression {0!r}>".format(source), "eval")
+
+    fn = eval(code, namespace)
+    fn.source = source
+
+    return fn
+
+
+def compile_expression(source):
+    """
+    Compile source into a function taking a message and returning the value
+    of the expression. Returns source as is if it is already compiled.
+    """
+    if callable(source):
+        return source
+
+    return _make_function(_parse(source), source)
+
+
+def compile_projection(fields):
+    """
+    Compile a projection into a function taking a message and returning a
+    new dict. Argument fields is either a list of field names to keep, or a
+    mapping from output field names to expressions. Returns fields as is if
+    it is already compiled.
+    """
+    if callable(fields):
+        return fields
+
+    if isinstance(fields, list):
+        fields = {name: name for name in fields}
+    if not isinstance(fields, dict) or not fields:
+        raise ExpressionError("A projection must be a list of field names "
+                              "or a mapping from field names to expressions")
+
+    keys, values = [], []
+    for name, source in fields.items():
+        if not isinstance(name, str):
+            raise ExpressionError("Field name must be a string: {0!r}".format(
+                name
+            ))
+        keys.append(ast.Str(s=name))
+        values.append(_parse(source))
+
+    body = ast.Dict(keys=keys, values=values)
+    source = repr(fields)
+
+    return _make_function(body, source)
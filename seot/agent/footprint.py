@@ -0,0 +1,135 @@
+"""
+Check the import time and resident memory of the agent against a budget.
+The startup phase covers importing the agent and probing node types.
+
+The measurement runs in a fresh interpreter so that modules already imported
+by the caller do not skew the result. Exits with a non-zero status when a
+budget is exceeded or when a heavy dependency is imported too early.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules which must not be imported by "import seot.agent"
+IMPORT_FORBIDDEN = ["aiohttp", "docker", "motor", "pygments", "pymongo",
+                    "yaml", "zmq"]
+# Modules which must not be imported until a job actually uses them, even
+# after probing node types
+STARTUP_FORBIDDEN = ["docker", "motor", "pygments", "pymongo"]
+
+_PROBE = """
+import json
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+CONFIG = {
+    "agent": {
+        "user_name": "footprint",
+        "coordinate": {"longitude": 0.0, "latitude": 0.0}
+    },
+    "cpp": {"base_url": "http://127.0.0.1:8888"}
+}
+
+
+def rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+result = {}
+
+start = time.perf_counter()
+import seot.agent
+result["import"] = {
+    "time": time.perf_counter() - start,
+    "rss_kb": rss_kb(),
+    "modules": sorted(sys.modules.keys())
+}
+
+start = time.perf_counter()
+import seot.agent.agent
+from seot.agent import config
+from seot.agent.graph_builder import GraphBuilder
+
+# Probe node types from scratch, as on the first start of an agent, without
+# touching its state file
+config.STATE_FILE_PATH = Path(tempfile.mkdtemp()) / "state.yml"
+config.restore({"config": config.validate(CONFIG), "state": {}})
+GraphBuilder.load_node_classes()
+result["startup"] = {
+    "time": time.perf_counter() - start + result["import"]["time"],
+    "rss_kb": rss_kb(),
+    "modules": sorted(sys.modules.keys())
+}
+
+print(json.dumps(result))
+"""
+
+
+def measure():
+    output = subprocess.check_output([sys.executable, "-c", _PROBE])
+    return json.loads(output.decode("utf-8"))
+
+
+def _top_level(modules):
+    return set(mod.split(".")[0] for mod in modules)
+
+
+def check(result, phase, max_time, max_rss_mb, forbidden):
+    errors = []
+    stats = result[phase]
+
+    print("{0}: {1:.3f}s, {2:.1f} MB RSS, {3} modules".format(
+        phase, stats["time"], stats["rss_kb"] / 1024, len(stats["modules"])
+    ))
+
+    if stats["time"] > max_time:
+        errors.append("{0} took {1:.3f}s (budget {2:.3f}s)".format(
+            phase, stats["time"], max_time
+        ))
+    if stats["rss_kb"] / 1024 > max_rss_mb:
+        errors.append("{0} used {1:.1f} MB RSS (budget {2:.1f} MB)".format(
+            phase, stats["rss_kb"] / 1024, max_rss_mb
+        ))
+
+    loaded = _top_level(stats["modules"]) & set(forbidden)
+    if loaded:
+        errors.append("{0} imported {1}".format(
+            phase, ", ".join(sorted(loaded))
+        ))
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--import-time", type=float, default=0.5,
+                        help="Import time budget in seconds")
+    parser.add_argument("--import-rss", type=float, default=24.0,
+                        help="Import RSS budget in megabytes")
+    parser.add_argument("--startup-time", type=float, default=2.0,
+                        help="Startup time budget in seconds")
+    parser.add_argument("--startup-rss", type=float, default=48.0,
+                        help="Startup RSS budget in megabytes")
+    args = parser.parse_args()
+
+    result = measure()
+
+    errors = check(result, "import", args.import_time, args.import_rss,
+                   IMPORT_FORBIDDEN)
+    errors += check(result, "startup", args.startup_time, args.startup_rss,
+                    STARTUP_FORBIDDEN)
+
+    for error in errors:
+        print("Budget exceeded: " + error)
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ from concurrent.futures import FIRST_EXCEPTION
 from contextlib import suppress
 
 from .node import Node
+from .sinks import BaseSink
+from .sources import BaseSource
+from .transformers import SimpleTransformer
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +36,8 @@ class Graph:
             self.loop = asyncio.get_event_loop()
 
         self._task = None
+        # Nodes running inside another node's task (see fuse_chains)
+        self._fused = set()
 
     def nodes(self):
         """
@@ -70,6 +75,53 @@ class Graph:
 
         return list(result)
 
+    @staticmethod
+    def _can_head_chain(node):
+        return (isinstance(node, SimpleTransformer) and
+                type(node)._run is SimpleTransformer._run and
+                node.concurrency == 1)
+
+    @staticmethod
+    def _can_join_chain(node):
+        if isinstance(node, BaseSource):
+            return Graph._can_head_chain(node)
+        return (isinstance(node, BaseSink) and
+                type(node)._run is BaseSink._run and
+                node.spill_dir is None)
+
+    def fuse_chains(self):
+        """
+        Fuse linear chains of SimpleTransformers (optionally ending with a
+        sink), so that each chain runs as a single task instead of passing
+        every message through a queue at each hop. Must be called before the
+        graph is started.
+        """
+        nodes = self.nodes()
+
+        in_degree = {node: 0 for node in nodes}
+        for node in nodes:
+            for next_node in node.next_nodes():
+                in_degree[next_node] += 1
+
+        for node in nodes:
+            if node in self._fused or not self._can_head_chain(node):
+                continue
+
+            tail = node
+            while isinstance(tail, BaseSource) and \
+                    len(tail.next_nodes()) == 1:
+                next_node = tail.next_nodes()[0]
+                if in_degree[next_node] != 1 or \
+                        not self._can_join_chain(next_node):
+                    break
+
+                logger.debug("Fusing node {0} into node {1}".format(
+                    next_node.name, node.name
+                ))
+                node.fuse(next_node)
+                self._fused.add(next_node)
+                tail = next_node
+
     async def start(self, done_cb=None):
         """
         Start this dataflow graph.
@@ -80,7 +132,8 @@ class Graph:
         async def _run():
             # Now we actually launch each node by calling .start()
             done, pending = await asyncio.wait(
-                [node.start() for node in self.nodes()],
+                [node.start() for node in self.nodes()
+                 if node not in self._fused],
                 loop=self.loop, return_when=FIRST_EXCEPTION
             )
 
@@ -118,7 +171,7 @@ class Graph:
 
         # Request nodes to stop and wait until them to actually stop
         with suppress(asyncio.CancelledError):
-            await asyncio.wait([node.stop() for node in self.nodes()],
+            await asyncio.wait([node.stop() for node in running_nodes],
                                loop=self.loop)
 
         # Now all nodes have stopped, but we need to wait until done_cb
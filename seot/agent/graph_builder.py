@@ -1,32 +1,209 @@
+import copy
+import hashlib
 import json
-from importlib import import_module
-from inspect import getmembers, isclass
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
 from logging import getLogger
-from pkgutil import walk_packages
 
 from schema import Optional, Schema
 
-import seot.agent
-
-import yaml
-
-from . import config
+from . import config, metrics, registry
 from .graph import Graph
-from .node import Node
 
 logger = getLogger(__name__)
 
 
+class GraphTemplate:
+    """
+    A validated and normalized dataflow graph definition, from which graphs
+    can be instantiated without validating the definition again
+    """
+    def __init__(self, nodes, edges, definition, key=None):
+        """
+        Initialize this template. Argument nodes is a list of (name, node
+        class, args) tuples, edges is a list of (from, to) name pairs and
+        definition is the validated graph definition. Argument key
+        identifies the definition; metrics reported by worker processes
+        running graphs of this template are stored under
+        graph.<key>.<metric name>.
+        """
+        self.nodes = nodes
+        self.edges = edges
+        self.definition = definition
+
+        self.metrics_scope = None
+        if key is not None:
+            self.metrics_scope = "graph.{0}".format(key[:16])
+
+        targets = set(dst for _, dst in edges)
+        self.source_names = [name for name, _, _ in nodes
+                             if name not in targets]
+
+    def _node_cost(self, name, timings):
+        metric_name = "node.{0}.process".format(name)
+        if self.metrics_scope is not None:
+            metric_name = self.metrics_scope + "." + metric_name
+
+        stats = timings.get(metric_name)
+        return stats["mean"] if stats else 0.0
+
+    def assign_partitions(self):
+        """
+        Return a mapping from node name to partition number. Nodes are
+        assigned by their partition arg. If the definition specifies a number
+        of partitions, the remaining nodes are balanced over them by their
+        processing cost measured in earlier runs of graphs of this template.
+        """
+        assignment = {}
+        for node_def in self.definition["nodes"]:
+            if "partition" in node_def:
+                assignment[node_def["name"]] = node_def["partition"]
+
+        count = self.definition.get("partitions")
+        unassigned = [name for name, _, _ in self.nodes
+                      if name not in assignment]
+        if not count:
+            assignment.update((name, 0) for name in unassigned)
+            return assignment
+
+        # Greedily put the most expensive node on the least loaded partition
+        timings = metrics.snapshot()["timings"]
+        loads = [0.0] * count
+        for name, partition in assignment.items():
+            loads[partition % count] += self._node_cost(name, timings)
+
+        unassigned.sort(key=lambda name: self._node_cost(name, timings),
+                        reverse=True)
+        for i, name in enumerate(unassigned):
+            cost = self._node_cost(name, timings)
+            # Spread nodes without measurements evenly
+            partition = (loads.index(min(loads)) if cost
+                         else i % count)
+            assignment[name] = partition
+            loads[partition] += cost
+
+        return assignment
+
+    def split(self, assignment):
+        """
+        Split this graph into one definition per partition. Edges crossing
+        partitions are replaced by a ZMQSink/ZMQSource pair over ipc://.
+        The ZMQSource reports the upstream node as the sender of messages, so
+        that downstream nodes see the same sender as in the unsplit graph.
+        """
+        token = uuid.uuid4().hex[:8]
+        links = 0
+        partitions = defaultdict(list)
+
+        for node_def in self.definition["nodes"]:
+            name = node_def["name"]
+            partition = assignment[name]
+            to = []
+
+            for dst in node_def.get("to", []):
+                if dst not in assignment:
+                    continue
+                if assignment[dst] == partition:
+                    to.append(dst)
+                    continue
+
+                url = "ipc://{0}/seot-{1}-{2}".format(
+                    tempfile.gettempdir(), token, links
+                )
+                link_name = "{0}->{1}".format(name, dst)
+                links += 1
+
+                to.append(link_name)
+                partitions[partition].append({
+                    "name": link_name,
+                    "type": "ZMQSink",
+                    "args": {"url": url}
+                })
+                partitions[assignment[dst]].append({
+                    "name": link_name,
+                    "type": "ZMQSource",
+                    "args": {"url": url, "sender": name},
+                    "to": [dst]
+                })
+
+            partitions[partition].append({
+                "name": name,
+                "type": node_def["type"],
+                "args": copy.deepcopy(node_def.get("args", {})),
+                "to": to
+            })
+
+        return [{"nodes": partitions[p]} for p in sorted(partitions)]
+
+    def instantiate(self, fuse=True, isolate=False, worker_options=None,
+                    **kwargs):
+        """
+        Create a new dataflow graph from this template. Linear chains of
+        transformers are fused unless argument fuse is False. If the nodes
+        are assigned to more than one partition, each partition runs in its
+        own worker process. Otherwise, if isolate is True, the whole graph
+        runs in a worker process. Argument worker_options is passed to the
+        worker processes.
+        """
+        worker_options = worker_options or {}
+
+        assignment = self.assign_partitions()
+        if len(set(assignment.values())) > 1:
+            from .worker import PartitionedGraph
+
+            return PartitionedGraph(self.split(assignment),
+                                    loop=kwargs.get("loop"),
+                                    metrics_scope=self.metrics_scope,
+                                    **worker_options)
+
+        if isolate:
+            from .worker import GraphWorker
+
+            return GraphWorker(self.definition, loop=kwargs.get("loop"),
+                               metrics_scope=self.metrics_scope,
+                               **worker_options)
+
+        nodes = {}
+        for name, node_cls, args in self.nodes:
+            # Node args may be mutated by nodes (e.g. ConstSource), so every
+            # instance gets its own copy
+            node_args = copy.deepcopy(args)
+            node_args["name"] = name
+            if "loop" in kwargs:
+                node_args["loop"] = kwargs["loop"]
+
+            nodes[name] = node_cls(**node_args)
+
+        for src, dst in self.edges:
+            nodes[src].connect(nodes[dst])
+
+        graph = Graph(*[nodes[name] for name in self.source_names], **kwargs)
+        if fuse:
+            graph.fuse_chains()
+
+        return graph
+
+
 class GraphBuilder:
+    # Node type -> module path of node types runnable on this platform
     REGISTERED_NODES = None
 
+    # Maximum number of compiled graph templates to keep
+    TEMPLATE_CACHE_SIZE = 32
+    _template_cache = OrderedDict()
+
     _GRAPH_DEF_SCHEMA = Schema({
         "nodes": [{
             "name": str,
             "type": str,
             Optional("args"): {Optional(str): object},
-            Optional("to"): [str]
-        }]
+            Optional("to"): [str],
+            Optional("partition"): int
+        }],
+        Optional("partitions"): int
     })
 
     @classmethod
@@ -36,17 +213,58 @@ class GraphBuilder:
 
     @classmethod
     def from_yaml(cls, filename, **kwargs):
+        import yaml
+
         with open(filename) as f:
             return cls.from_obj(yaml.load(f), **kwargs)
 
     @classmethod
     def from_obj(cls, obj, **kwargs):
+        template = cls.compile(obj)
+
+        with metrics.timed("graph.instantiate"):
+            return template.instantiate(**kwargs)
+
+    @staticmethod
+    def _digest(obj):
+        serialized = json.dumps(obj, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def compile(cls, obj):
+        """
+        Validate a graph definition and return a GraphTemplate. Templates are
+        cached by the content hash of the definition.
+        """
+        key = cls._digest(obj)
+
+        template = cls._template_cache.get(key)
+        if template is not None:
+            cls._template_cache.move_to_end(key)
+            metrics.incr("graph.template_cache.hits")
+            return template
+
+        metrics.incr("graph.template_cache.misses")
+
+        start = time.perf_counter()
+        template = cls._compile(copy.deepcopy(obj), key)
+        metrics.observe("graph.compile", time.perf_counter() - start)
+
+        cls._template_cache[key] = template
+        while len(cls._template_cache) > cls.TEMPLATE_CACHE_SIZE:
+            cls._template_cache.popitem(last=False)
+
+        return template
+
+    @classmethod
+    def _compile(cls, obj, key=None):
         if cls.REGISTERED_NODES is None:
             cls.load_node_classes()
 
         graph_def = cls._GRAPH_DEF_SCHEMA.validate(obj)
 
-        nodes = {}
+        nodes = []
+        names = set()
         for node_def in graph_def["nodes"]:
             cls_name = node_def["type"]
             if cls_name not in cls.REGISTERED_NODES:
@@ -54,60 +272,77 @@ class GraphBuilder:
                     cls_name
                 ))
 
-            node_cls = cls.REGISTERED_NODES[cls_name]
-            node_args = node_def.get("args", {})
-            node_args["name"] = node_def["name"]
-            if "loop" in kwargs:
-                node_args["loop"] = kwargs["loop"]
+            node_cls = registry.load_class(cls_name)
+            try:
+                args = node_cls.validate_args(node_def.get("args", {}))
+            except ValueError as e:
+                raise ValueError("Invalid args of node {0}: {1}".format(
+                    node_def["name"], e
+                ))
 
-            nodes[node_def["name"]] = node_cls(**node_args)
+            nodes.append((node_def["name"], node_cls, args))
+            names.add(node_def["name"])
 
-        sources = set(nodes.values())
+        edges = []
         for node_def in graph_def["nodes"]:
-            if "to" not in node_def:
-                continue
-
-            for next_node in node_def["to"]:
-                if next_node not in nodes:
+            for next_node in node_def.get("to", []):
+                if next_node not in names:
                     logger.warning("Ignoring unknown destionation node {0}"
                                    .format(next_node))
                     continue
 
-                nodes[node_def["name"]].connect(nodes[next_node])
-                sources.discard(nodes[next_node])
+                edges.append((node_def["name"], next_node))
 
-        return Graph(*sources, **kwargs)
+        return GraphTemplate(nodes, edges, graph_def, key)
 
     @classmethod
     def load_node_classes(cls):
-        cls.REGISTERED_NODES = {}
+        """
+        Determine which node types are runnable on this platform. Probes run
+        in a subprocess (see registry.probe_all) and their results are cached
+        in the state file; a stale cache is used as is and refreshed in the
+        background.
+        """
+        record = config.get_state("node_probes")
 
-        blacklist = set(config.get("node_blacklist") or [])
+        if not registry.is_usable(record):
+            logger.info("Probing available node types...")
+            record = registry.probe_all()
+            config.set_state("node_probes", record)
+        elif not registry.is_fresh(record, config.get("node_probe_ttl")):
+            logger.info("Cached node probes are stale; re-probing in the "
+                        "background")
+            thread = threading.Thread(target=cls._reprobe, daemon=True)
+            thread.start()
 
-        root_pkg = seot.agent
-        pkgs = walk_packages(root_pkg.__path__, root_pkg.__name__ + ".")
+        cls._register(record)
 
-        # Walk over all submodules of seot.agent
-        for importer, mod_name, is_pkg in pkgs:
-            try:
-                mod = import_module(mod_name)
-            except:
-                continue
+    @classmethod
+    def _reprobe(cls):
+        # Device sources held by running jobs skip opening the device and
+        # report themselves runnable (see DeviceSource._device_in_use), so
+        # only types which really became unavailable are unregistered
+        record = registry.probe_all()
 
-            def is_node(node_cls):
-                # check if c is a subclass of Node
-                if isclass(node_cls) and issubclass(node_cls, Node):
-                    # check if c can run on this platform
-                    if node_cls != Node and node_cls.can_run():
-                        return True
+        config.set_state("node_probes", record)
+        cls._register(record)
 
-                return False
+    @classmethod
+    def _register(cls, record):
+        blacklist = set(config.get("node_blacklist") or [])
 
-            for cls_name, node_cls in getmembers(mod, is_node):
-                if cls_name in blacklist:
-                    continue
+        registered = {
+            node_type: registry.NODE_MODULES[node_type]
+            for node_type, ok in sorted(record["results"].items())
+            if ok and node_type not in blacklist
+        }
 
-                logger.debug("Loaded node type {0} from module {1}".format(
-                    cls_name, mod_name
-                ))
-                cls.REGISTERED_NODES[cls_name] = node_cls
+        # Cached templates were validated against the previous node types
+        if cls.REGISTERED_NODES is not None and \
+                registered != cls.REGISTERED_NODES:
+            cls._template_cache.clear()
+        cls.REGISTERED_NODES = registered
+
+        logger.debug("Available node types: {0}".format(
+            ", ".join(cls.REGISTERED_NODES.keys())
+        ))
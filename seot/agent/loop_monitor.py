@@ -0,0 +1,150 @@
+"""
+Event loop lag monitor and blocking call detector
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from logging import getLogger
+
+from . import metrics
+
+logger = getLogger(__name__)
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop runs a timer scheduled every interval
+    seconds and records the delay in the loop.lag histogram. A watchdog
+    thread detects when the loop has not run for longer than threshold
+    seconds, captures the stack of the blocked loop thread and attributes it
+    to the node (and job) it is executing.
+    """
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0,
+               2.0, 5.0)
+
+    def __init__(self, loop=None, interval=0.1, threshold=0.1):
+        self.interval = interval
+        self.threshold = threshold
+
+        self.loop = loop
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        # id(node) -> (node name, job ID)
+        self._owners = {}
+        self._handle = None
+        self._expected = None
+        self._last_beat = None
+        self._thread = None
+        self._thread_ident = None
+        self._stopping = threading.Event()
+
+    def attribute(self, nodes, job_id=None):
+        """
+        Attribute blocking calls made by nodes to a job.
+        """
+        for node in nodes:
+            self._owners[id(node)] = (node.name, job_id)
+
+    def forget(self, nodes):
+        """
+        Stop attributing blocking calls made by nodes.
+        """
+        for node in nodes:
+            self._owners.pop(id(node), None)
+
+    def start(self):
+        """
+        Start monitoring. Must be called from the event loop thread.
+        """
+        self._thread_ident = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected, self._probe)
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch,
+                                        name="seot-loop-monitor",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop monitoring.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _probe(self):
+        now = self.loop.time()
+        lag = max(now - self._expected, 0.0)
+
+        metrics.histogram("loop.lag", lag, self.BUCKETS)
+        metrics.set_gauge("loop.lag", lag)
+
+        self._last_beat = time.monotonic()
+        self._expected = now + self.interval
+        self._handle = self.loop.call_at(self._expected, self._probe)
+
+    def _watch(self):
+        stalled_since = None
+        culprit = None
+
+        while not self._stopping.wait(self.threshold / 2):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat - self.interval
+
+            if stalled > self.threshold and stalled_since != beat:
+                stalled_since = beat
+                culprit = self._report_block(stalled)
+            elif stalled_since is not None and stalled_since != beat:
+                # The loop ran again
+                duration = beat - stalled_since - self.interval
+                metrics.observe("loop.blocked", duration)
+                logger.warning("Event loop was blocked for {0:.0f}ms by "
+                               "{1}".format(duration * 1000, culprit))
+                stalled_since = None
+
+    def _find_owner(self, frame):
+        from .node import Node
+
+        while frame is not None:
+            owner = frame.f_locals.get("self")
+            if id(owner) in self._owners:
+                return self._owners[id(owner)]
+            if isinstance(owner, Node):
+                return owner.name, None
+            frame = frame.f_back
+
+        return None, None
+
+    def _report_block(self, stalled):
+        frame = sys._current_frames().get(self._thread_ident)
+        if frame is None:
+            return "unknown"
+
+        node, job_id = self._find_owner(frame)
+        if node is None:
+            culprit = "agent code"
+        elif job_id is None:
+            culprit = "node {0}".format(node)
+        else:
+            culprit = "node {0} of job {1}".format(node, job_id)
+
+        metrics.incr("loop.blocked")
+        if node is not None:
+            metrics.incr("node.{0}.loop_blocked".format(node))
+
+        logger.warning("Event loop has been blocked for {0:.0f}ms by {1}:\n"
+                       "{2}".format(stalled * 1000, culprit,
+                                    "".join(traceback.format_stack(frame))))
+
+        return culprit
@@ -0,0 +1,110 @@
+"""
+Lightweight in-process metrics registry
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+_histograms = {}
+
+
+def incr(name, value=1):
+    """ Increment a counter """
+    _counters[name] += value
+
+
+def set_gauge(name, value):
+    """ Set a gauge to the current value """
+    _gauges[name] = value
+
+
+def observe(name, value):
+    """ Record a sample (usually a duration in seconds) """
+    stats = _timings.get(name)
+    if stats is None:
+        _timings[name] = [1, value, value, value]
+        return
+
+    stats[0] += 1
+    stats[1] += value
+    if value < stats[2]:
+        stats[2] = value
+    if value > stats[3]:
+        stats[3] = value
+
+
+def histogram(name, value, buckets):
+    """
+    Record a sample in a histogram. Argument buckets is a sorted sequence of
+    upper bounds; samples above the last bound go to an overflow bucket.
+    """
+    hist = _histograms.get(name)
+    if hist is None:
+        hist = _histograms[name] = (tuple(buckets), [0] * (len(buckets) + 1))
+
+    bounds, counts = hist
+    counts[bisect_left(bounds, value)] += 1
+
+
+@contextmanager
+def timed(name):
+    """ Record the wall-clock duration of a block """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def snapshot():
+    """ Return a copy of all metrics """
+    return {
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "timings": {
+            name: {
+                "count": count,
+                "total": total,
+                "min": min_,
+                "max": max_,
+                "mean": total / count
+            }
+            for name, (count, total, min_, max_) in _timings.items()
+        },
+        "histograms": {
+            name: {
+                "buckets": list(bounds),
+                "counts": list(counts)
+            }
+            for name, (bounds, counts) in _histograms.items()
+        }
+    }
+
+
+def merge(snapshot, prefix):
+    """
+    Store the metrics of a snapshot (e.g. one reported by a worker process)
+    under their names prefixed with prefix, replacing earlier values
+    """
+    for name, value in snapshot["counters"].items():
+        _counters[prefix + name] = value
+    for name, value in snapshot["gauges"].items():
+        _gauges[prefix + name] = value
+    for name, stats in snapshot["timings"].items():
+        _timings[prefix + name] = [stats["count"], stats["total"],
+                                   stats["min"], stats["max"]]
+    for name, hist in snapshot["histograms"].items():
+        _histograms[prefix + name] = (tuple(hist["buckets"]),
+                                      list(hist["counts"]))
+
+
+def reset():
+    """ Clear all metrics """
+    _counters.clear()
+    _gauges.clear()
+    _timings.clear()
+    _histograms.clear()
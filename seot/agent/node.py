@@ -89,6 +89,15 @@ class Node(ABC):
         """
         return []
 
+    @classmethod
+    def validate_args(cls, args):
+        """
+        Validate the args of a node of this type when a graph definition is
+        compiled, and return the args to instantiate it with. Raises
+        ValueError if they are invalid.
+        """
+        return args
+
     @classmethod
     def can_run(cls):
         """
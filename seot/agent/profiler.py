@@ -0,0 +1,170 @@
+"""
+On-demand profiling of the agent, a job or a single node
+"""
+import asyncio
+import signal
+import tempfile
+import threading
+import time
+from collections import Counter
+from logging import getLogger
+from pathlib import Path
+
+logger = getLogger(__name__)
+
+DEFAULT_OUTPUT_DIR = Path(tempfile.gettempdir()) / "seot-profiles"
+
+
+class ProfileSession:
+    """
+    Profiles the event loop thread for a bounded window and writes the result
+    to a file, then turns itself off.
+
+    Two modes are supported:
+
+    - cprofile: deterministic profiling with cProfile, written as a pstats
+      file. It covers everything running on the event loop, so it cannot be
+      narrowed to particular nodes.
+    - sample: statistical profiling that samples the stack every interval
+      seconds of CPU time, written as collapsed stacks (one
+      "frame;frame;... count" line per stack) for flame graph tools. If
+      nodes are given, only stacks executing one of them are kept. Samples
+      are taken by a SIGPROF handler rather than a thread, since a thread
+      would mostly observe the event loop blocked in select(), where the
+      GIL is released. The event loop must run in the main thread.
+    """
+    MODES = ("cprofile", "sample")
+
+    def __init__(self, mode="cprofile", duration=30, nodes=None,
+                 interval=0.01, output_dir=None, label="agent", loop=None):
+        if mode not in self.MODES:
+            raise ValueError("mode must be one of {0}".format(
+                ", ".join(self.MODES)
+            ))
+
+        self.mode = mode
+        self.duration = duration
+        self.nodes = list(nodes) if nodes else None
+        self.interval = interval
+        self.output_dir = Path(output_dir or DEFAULT_OUTPUT_DIR)
+        self.label = label
+        # Path of the written profile, set when the session finishes
+        self.path = None
+
+        self.loop = loop
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        self.done = self.loop.create_future()
+
+        self._profile = None
+        self._samples = Counter()
+        self._previous_handler = None
+        self._timer = None
+        self._node_ids = None
+        if self.nodes is not None:
+            self._node_ids = set(id(node) for node in self.nodes)
+
+    def active(self):
+        """
+        Returns whether this session is collecting data or not.
+        """
+        return self._timer is not None
+
+    def start(self):
+        """
+        Start collecting. Must be called from the event loop thread.
+        """
+        if self.active():
+            raise RuntimeError("Profile session is already running")
+
+        if self.mode == "cprofile":
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            if threading.current_thread() is not threading.main_thread():
+                raise RuntimeError("Sample mode requires the event loop to "
+                                   "run in the main thread")
+
+            self._previous_handler = signal.signal(signal.SIGPROF,
+                                                   self._on_sigprof)
+            signal.setitimer(signal.ITIMER_PROF, self.interval,
+                             self.interval)
+
+        self._timer = self.loop.call_later(self.duration, self.stop)
+
+        logger.info("Started {0} profile of {1} for {2}s".format(
+            self.mode, self.label, self.duration
+        ))
+
+    def stop(self):
+        """
+        Stop collecting and write the profile. Returns the path of the file.
+        """
+        if not self.active():
+            return self.path
+
+        self._timer.cancel()
+        self._timer = None
+
+        if self.mode == "cprofile":
+            self._profile.disable()
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+
+        try:
+            self.path = self._write()
+            logger.info("Wrote {0} profile of {1} to {2}".format(
+                self.mode, self.label, self.path
+            ))
+        except OSError as e:
+            logger.error("Failed to write profile: {0}".format(e))
+
+        if not self.done.done():
+            self.done.set_result(self.path)
+
+        return self.path
+
+    def _write(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = "{0}-{1}".format(self.label,
+                                time.strftime("%Y%m%d-%H%M%S"))
+
+        if self.mode == "cprofile":
+            path = self.output_dir / (stem + ".prof")
+            self._profile.dump_stats(str(path))
+        else:
+            path = self.output_dir / (stem + ".collapsed")
+            with path.open("w") as f:
+                for stack, count in self._samples.most_common():
+                    f.write("{0} {1}\n".format(stack, count))
+
+        return path
+
+    def _on_sigprof(self, signum, frame):
+        labels = []
+        matched = self._node_ids is None
+
+        while frame is not None:
+            owner = frame.f_locals.get("self")
+            if not matched and id(owner) in self._node_ids:
+                matched = True
+
+            code = frame.f_code
+            if owner is not None:
+                name = "{0}.{1}".format(owner.__class__.__name__,
+                                        code.co_name)
+            else:
+                name = code.co_name
+            labels.append("{0}:{1}".format(
+                frame.f_globals.get("__name__", "?"), name
+            ))
+
+            frame = frame.f_back
+
+        if matched:
+            labels.reverse()
+            self._samples[";".join(labels)] += 1
@@ -0,0 +1,215 @@
+"""
+Compact fixed-schema messages
+
+A record type is a class with __slots__ generated from a list of field
+names. Its instances take far less memory than the equivalent dicts, but
+they behave like mutable mappings of their fields plus meta, so nodes written
+for dict messages handle them unchanged. Fields are always present (None by
+default), while meta is absent until a source stamps it. Only declared keys
+can be stored; writing any other key raises KeyError, and nodes which need
+to add keys build a new dict instead.
+
+Records are encoded by dpp as msgpack arrays of their values in field
+order, followed by meta. Receivers need the field names to decode them (see
+the schema argument of ZMQSource and dpp.decode()).
+"""
+import collections.abc
+import time
+
+# (fields, optional) -> record type
+_record_types = {}
+
+
+class Record(collections.abc.MutableMapping):
+    """
+    Base class of record types. Use record_type() to create one.
+    """
+    __slots__ = ()
+
+    _fields = ()
+    _optional = ()
+    _slot_names = ()
+    _keys = frozenset()
+
+    def __getitem__(self, key):
+        if key in self._keys:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            raise KeyError("{0} has no field {1!r}".format(
+                type(self).__name__, key
+            ))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._optional:
+            return hasattr(self, key)
+        return key in self._keys
+
+    def __iter__(self):
+        for name in self._slot_names:
+            if hasattr(self, name):
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        if key in self._keys:
+            return getattr(self, key, default)
+        return default
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __copy__(self):
+        copied = type(self).__new__(type(self))
+        for name in self:
+            setattr(copied, name, getattr(self, name))
+        return copied
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(name, getattr(self, name)) for name in self
+        ))
+
+    def items(self):
+        """
+        Return a list of (key, value) pairs. Generated for each record type,
+        since nodes iterate over messages with items() in hot paths.
+        """
+        raise NotImplementedError
+
+    def to_list(self):
+        """
+        Return the values in field order followed by the optional keys (None
+        if absent), which is how records are encoded. Generated for each
+        record type.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        Create a record from values returned by to_list(). Optional keys
+        whose value is None are left absent.
+        """
+        record = cls.__new__(cls)
+        for name, value in zip(cls._slot_names, values):
+            if value is not None or name not in cls._optional:
+                setattr(record, name, value)
+        return record
+
+
+# Generated per record type, as collections.namedtuple does, so that creating
+# and encoding records costs no more than building the equivalent dicts
+_TEMPLATE = """
+def __init__(self, {args}):
+    {assignments}
+
+def to_list(self):
+    return [{values}]
+
+def items(self):
+    items = [{items}]
+    for name in {optional!r}:
+        if hasattr(self, name):
+            items.append((name, getattr(self, name)))
+    return items
+"""
+
+
+def record_type(fields, name=None, optional=("meta",)):
+    """
+    Return the record type with the given field names. Types are cached by
+    their fields, so the same schema always gives the same class. Keys in
+    optional (meta by default) can be stored besides fields, but are absent
+    until they are assigned.
+    """
+    fields = tuple(fields)
+    optional = tuple(optional)
+    key = (fields, optional)
+
+    cls = _record_types.get(key)
+    if cls is not None:
+        return cls
+
+    slot_names = fields + optional
+    if len(set(slot_names)) != len(slot_names):
+        raise ValueError("Duplicate field names in {0}".format(slot_names))
+    if not all(isinstance(field, str) and field.isidentifier() and
+               not field.startswith("_") for field in slot_names):
+        raise ValueError("Field names must be identifiers not starting with "
+                         "an underscore")
+
+    source = _TEMPLATE.format(
+        args=", ".join("{0}=None".format(field) for field in fields),
+        assignments="\n    ".join("self.{0} = {0}".format(field)
+                                  for field in fields) or "pass",
+        values=", ".join(["self.{0}".format(field) for field in fields] +
+                         ["getattr(self, {0!r}, None)".format(field)
+                          for field in optional]),
+        items=", ".join("({0!r}, self.{0})".format(field) for field in fields),
+        optional=optional
+    )
+    namespace = {}
+    exec(source, namespace)
+
+    cls = type(name or "Record", (Record,), {
+        "__slots__": slot_names,
+        "__init__": namespace["__init__"],
+        "to_list": namespace["to_list"],
+        "items": namespace["items"],
+        "_fields": fields,
+        "_optional": optional,
+        "_slot_names": slot_names,
+        "_keys": frozenset(slot_names)
+    })
+    _record_types[key] = cls
+
+    return cls
+
+
+# Metadata attached to records by sources (see BaseSource._stamp_meta)
+Meta = record_type(("agent_id", "longitude", "latitude", "timestamp"),
+                   name="Meta", optional=("trace",))
+
+
+def make_meta(template=None):
+    """
+    Return a Meta record with the agent metadata in template and the current
+    time.
+    """
+    if template:
+        return Meta(timestamp=time.time(), **template)
+
+    return Meta(timestamp=time.time())
+
+
+def decode(values, cls):
+    """
+    Turn a decoded msgpack array back into a record of type cls, decoding
+    its meta array as well.
+    """
+    record = cls.from_list(values)
+
+    meta = record.get("meta")
+    if isinstance(meta, list):
+        record.meta = Meta.from_list(meta)
+
+    return record
@@ -0,0 +1,143 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+from importlib import import_module
+from logging import getLogger
+
+from . import devices, meta
+
+logger = getLogger(__name__)
+
+# Node type -> module (relative to seot.agent) defining the node class. Node
+# modules are only imported when a node type is probed or instantiated.
+NODE_MODULES = {
+    "ConstSource": ".sources.const",
+    "NullSource": ".sources.null",
+    "PiCameraSource": ".sources.pi_camera",
+    "SenseHatSource": ".sources.sense_hat",
+    "StubSenseHatSource": ".sources.stub_sense_hat",
+    "ZMQSource": ".sources.zmq",
+    "DebugSink": ".sinks.debug",
+    "FileSystemSink": ".sinks.fs",
+    "MongoDBSink": ".sinks.mongodb",
+    "NullSink": ".sinks.null",
+    "RingStoreSink": ".sinks.ring_store",
+    "ZMQSink": ".sinks.zmq",
+    "DeadbandFilter": ".transformers.deadband",
+    "DockerTransformer": ".transformers.docker",
+    "FilterTransformer": ".transformers.filter",
+    "IdentityTransformer": ".transformers.identity",
+    "JoinTransformer": ".transformers.join",
+    "LoadBalancer": ".transformers.load_balancer",
+}
+
+_loaded_classes = {}
+
+
+def load_class(node_type):
+    """
+    Import the module defining node_type and return the node class.
+    """
+    node_cls = _loaded_classes.get(node_type)
+    if node_cls is not None:
+        return node_cls
+
+    if node_type not in NODE_MODULES:
+        raise RuntimeError("Unknown node type {0}".format(node_type))
+
+    mod = import_module(NODE_MODULES[node_type], package=__package__)
+    node_cls = getattr(mod, node_type)
+    _loaded_classes[node_type] = node_cls
+
+    logger.debug("Loaded node type {0} from module {1}".format(
+        node_type, mod.__name__
+    ))
+
+    return node_cls
+
+
+def probe(node_type):
+    """
+    Return whether node_type can run on the current platform.
+    """
+    try:
+        return bool(load_class(node_type).can_run())
+    except Exception as e:
+        logger.debug("Node type {0} is not available: {1}".format(
+            node_type, e
+        ))
+        return False
+
+
+def _probe_in_subprocess(node_types):
+    command = [sys.executable, "-m", __name__]
+    for key in sorted(devices.open_devices()):
+        command += ["--busy", key]
+    command += node_types
+
+    output = subprocess.check_output(command)
+    # Node modules may print on import; the results are the last line
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def probe_all(node_types=None):
+    """
+    Probe node types and return a probe record suitable for the state file.
+    Probes run in a subprocess so that the modules of all node types and
+    their dependencies (docker, pymongo and the like) are not imported into
+    the agent; devices open in this process are reported busy to it.
+    """
+    if node_types is None:
+        node_types = NODE_MODULES.keys()
+    node_types = list(node_types)
+
+    try:
+        results = _probe_in_subprocess(node_types)
+    except (OSError, ValueError, IndexError,
+            subprocess.CalledProcessError) as e:
+        logger.warning("Probing node types in a subprocess failed ({0}); "
+                       "probing in this process".format(e))
+        results = {node_type: probe(node_type) for node_type in node_types}
+
+    return {
+        "version": meta.__version__,
+        "probed_at": time.time(),
+        "results": results
+    }
+
+
+def is_fresh(record, ttl):
+    """
+    Return whether a cached probe record is still valid.
+    """
+    return time.time() - record["probed_at"] < ttl
+
+
+def is_usable(record):
+    """
+    Return whether a cached probe record can be used at all, even if stale.
+    """
+    if record is None or record.get("version") != meta.__version__:
+        return False
+
+    return set(record["results"].keys()) == set(NODE_MODULES.keys())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Probe node types and print the results as JSON"
+    )
+    parser.add_argument("--busy", action="append", default=[],
+                        help="Key of a device held by the calling process")
+    parser.add_argument("node_types", nargs="*")
+    args = parser.parse_args()
+
+    devices.hold_elsewhere(args.busy)
+    print(json.dumps({node_type: probe(node_type)
+                      for node_type in args.node_types}))
+
+
+if __name__ == "__main__":
+    main()
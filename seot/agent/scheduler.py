@@ -0,0 +1,190 @@
+"""
+Shared timer scheduler for periodic nodes
+"""
+import heapq
+import itertools
+import math
+import random
+import weakref
+from logging import getLogger
+
+from . import metrics
+
+logger = getLogger(__name__)
+
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(loop):
+    """ Return the TimerScheduler of an event loop, creating it if needed """
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        scheduler = TimerScheduler(loop)
+        _schedulers[loop] = scheduler
+
+    return scheduler
+
+
+class Ticker:
+    """
+    A subscription to periodic ticks of a TimerScheduler
+    """
+    def __init__(self, scheduler, group, name=None):
+        self.name = name
+        # Number of ticks that fired while the subscriber was busy
+        self.missed = 0
+
+        self._scheduler = scheduler
+        self._group = group
+        self._fired = 0
+        self._waiter = None
+        self._metric_name = None
+        if name is not None:
+            self._metric_name = "node.{0}.missed_ticks".format(name)
+
+    @property
+    def period(self):
+        return self._group.period
+
+    def _tick(self, count):
+        self._fired += count
+
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait(self):
+        """
+        Wait for the next tick. If ticks have already fired since the last
+        call, return immediately. Returns the number of ticks missed.
+        """
+        if not self._fired:
+            self._waiter = self._scheduler.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        missed = self._fired - 1
+        self._fired = 0
+
+        if missed:
+            self.missed += missed
+            self._scheduler.missed_ticks += missed
+            metrics.incr("scheduler.missed_ticks", missed)
+            if self._metric_name is not None:
+                metrics.incr(self._metric_name, missed)
+            logger.debug("Ticker {0} missed {1} ticks".format(self.name,
+                                                              missed))
+
+        return missed
+
+    def cancel(self):
+        """
+        Unsubscribe from the scheduler.
+        """
+        self._scheduler._unsubscribe(self)
+
+
+class _TimerGroup:
+    def __init__(self, period, phase, deadline):
+        self.period = period
+        self.phase = phase
+        self.deadline = deadline
+        self.tickers = set()
+
+
+class TimerScheduler:
+    """
+    Fires periodic ticks on absolute deadlines using a single event loop
+    timer. Deadlines are multiples of the period plus a phase offset, so
+    periods do not drift by the time subscribers spend handling a tick, and
+    subscribers with the same period and phase are woken by one timer
+    expiry.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        # Total number of ticks missed by all subscribers
+        self.missed_ticks = 0
+
+        # (period, phase) -> _TimerGroup
+        self._groups = {}
+        # Heap of (deadline, sequence, _TimerGroup)
+        self._heap = []
+        self._seq = itertools.count()
+        self._handle = None
+        self._armed_at = None
+
+    def subscribe(self, period, phase=0.0, jitter=0.0, name=None):
+        """
+        Return a Ticker firing every period seconds. Deadlines are offset by
+        phase seconds plus a random offset of up to jitter seconds, which
+        spreads the load of sources with the same period at the cost of
+        coalescing.
+        """
+        if period <= 0:
+            raise ValueError("period must be positive")
+
+        if jitter:
+            phase += random.uniform(0, jitter)
+        phase %= period
+
+        key = (period, phase)
+        group = self._groups.get(key)
+        if group is None:
+            now = self.loop.time()
+            deadline = (math.floor((now - phase) / period) + 1) * period + \
+                phase
+            group = _TimerGroup(period, phase, deadline)
+            self._groups[key] = group
+            self._push(group)
+
+        ticker = Ticker(self, group, name)
+        group.tickers.add(ticker)
+
+        return ticker
+
+    def _unsubscribe(self, ticker):
+        group = ticker._group
+        group.tickers.discard(ticker)
+
+        # The heap entry is dropped lazily when it expires
+        if not group.tickers and \
+                self._groups.get((group.period, group.phase)) is group:
+            del self._groups[(group.period, group.phase)]
+
+    def _push(self, group):
+        heapq.heappush(self._heap, (group.deadline, next(self._seq), group))
+        self._arm()
+
+    def _arm(self):
+        if not self._heap:
+            return
+
+        deadline = self._heap[0][0]
+        if self._handle is not None:
+            if self._armed_at <= deadline:
+                return
+            self._handle.cancel()
+
+        self._handle = self.loop.call_at(deadline, self._fire)
+        self._armed_at = deadline
+
+    def _fire(self):
+        self._handle = None
+        now = self.loop.time()
+
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, group = heapq.heappop(self._heap)
+            if not group.tickers:
+                continue
+
+            # Deadlines that passed while the event loop was blocked
+            skipped = int((now - deadline) // group.period)
+            for ticker in list(group.tickers):
+                ticker._tick(skipped + 1)
+
+            group.deadline = deadline + (skipped + 1) * group.period
+            heapq.heappush(self._heap,
+                           (group.deadline, next(self._seq), group))
+
+        self._arm()
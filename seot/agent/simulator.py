@@ -0,0 +1,299 @@
+"""
+Simulate a fleet of agents against a local cpp stand-in.
+
+Usage: python -m seot.agent.simulator [--agents N] [--duration N]
+                                      [--job-rate N] [--job-lifetime N]
+
+All agents run in this process and share one event loop, but each has its own
+configurations and state. Jobs built from stub nodes are submitted to random
+agents and killed after their lifetime. Job start latency (from submission
+until the graph of the job has started), heartbeat jitter (deviation of
+heartbeat intervals from the configured interval) and event loop lag are
+reported at the end.
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import platform
+import random
+import time
+import uuid
+from collections import defaultdict
+from logging import getLogger
+
+from . import config, meta
+from .agent import Agent
+from .cpp_standin import CPPStandin
+from .graph_builder import GraphBuilder
+from .util import configure_logging
+
+logger = getLogger(__name__)
+
+DEFAULT_JOB = {
+    "nodes": [
+        {
+            "name": "source",
+            "type": "ConstSource",
+            "args": {"const": {"value": 1}, "interval": 1},
+            "to": ["sink"]
+        },
+        {
+            "name": "sink",
+            "type": "NullSink"
+        }
+    ]
+}
+
+
+def summarize(samples):
+    """
+    Return the count, mean, median, 99th percentile and maximum of a list of
+    samples.
+    """
+    if not samples:
+        return {"count": 0}
+
+    samples = sorted(samples)
+    count = len(samples)
+
+    return {
+        "count": count,
+        "mean": sum(samples) / count,
+        "p50": samples[count // 2],
+        "p99": samples[min(count - 1, int(count * 0.99))],
+        "max": samples[-1]
+    }
+
+
+class FleetSimulator:
+    """
+    Runs many Agent instances against a CPPStandin and drives job churn.
+    """
+    # Seconds between event loop lag probes
+    LAG_PROBE_INTERVAL = 0.1
+
+    def __init__(self, agents=100, heartbeat_interval=10, long_poll=True,
+                 job_rate=10.0, job_lifetime=5.0, job_def=None, port=18888,
+                 loop=None):
+        self.agent_count = agents
+        self.heartbeat_interval = heartbeat_interval
+        self.long_poll = long_poll
+        self.job_rate = job_rate
+        self.job_lifetime = job_lifetime
+        self.job_def = job_def or DEFAULT_JOB
+
+        self.loop = loop
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        self.server = CPPStandin(port=port, long_poll=long_poll,
+                                 loop=self.loop)
+        self.agents = []
+        self.lags = []
+        # Job ID -> time the graph of the job started
+        self.job_starts = {}
+
+    def _settings(self, i):
+        settings = config.validate({
+            "agent": {
+                "user_name": "sim-{0}".format(i),
+                "coordinate": {
+                    "longitude": random.uniform(-180.0, 180.0),
+                    "latitude": random.uniform(-90.0, 90.0)
+                }
+            },
+            "cpp": {
+                "base_url": self.server.base_url,
+                "heartbeat_interval": self.heartbeat_interval,
+                "long_poll": self.long_poll,
+                # Jitter is measured against one interval in both modes
+                "long_poll_heartbeat_interval": self.heartbeat_interval
+            }
+        })
+        settings["facts"] = {
+            "agent_version": meta.__version__,
+            "arch": platform.machine(),
+            "python": " ".join([
+                platform.python_implementation(),
+                platform.python_version()
+            ]),
+            "kernel": platform.system(),
+            "ip": "127.0.0.1",
+            "hostname": "sim-{0}".format(i)
+        }
+
+        return settings
+
+    def _state(self):
+        return {
+            "version": meta.__version__,
+            "agent_id": str(uuid.uuid4())
+        }
+
+    async def _start_agent(self, agent):
+        # Spread heartbeats over the interval like a real fleet
+        await asyncio.sleep(random.uniform(0, self.heartbeat_interval),
+                            loop=self.loop)
+        await agent.start()
+
+    async def _probe_lag(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.LAG_PROBE_INTERVAL, loop=self.loop)
+            self.lags.append(self.loop.time() - start -
+                             self.LAG_PROBE_INTERVAL)
+
+    def _on_job_start(self, job_id):
+        self.job_starts[job_id] = time.time()
+
+    async def _churn(self):
+        while True:
+            await asyncio.sleep(random.expovariate(self.job_rate),
+                                loop=self.loop)
+
+            agent = random.choice(self.agents)
+            agent_id = agent._get_state("agent_id")
+            job_id = self.server.submit(agent_id, copy.deepcopy(self.job_def))
+            self.loop.call_later(self.job_lifetime, self.server.kill,
+                                 agent_id, job_id)
+
+    async def run(self, duration):
+        """
+        Run the simulation for duration seconds and return a report.
+        """
+        await self.server.start()
+
+        self.agents = [
+            Agent(loop=self.loop, settings=self._settings(i),
+                  state=self._state(), on_job_start=self._on_job_start)
+            for i in range(self.agent_count)
+        ]
+        starters = [
+            asyncio.ensure_future(self._start_agent(agent), loop=self.loop)
+            for agent in self.agents
+        ]
+        lag_probe = asyncio.ensure_future(self._probe_lag(), loop=self.loop)
+        churn = asyncio.ensure_future(self._churn(), loop=self.loop)
+
+        started_at = time.time()
+        await asyncio.sleep(duration, loop=self.loop)
+
+        churn.cancel()
+        lag_probe.cancel()
+        for starter in starters:
+            starter.cancel()
+
+        await asyncio.wait([churn, lag_probe] + starters, loop=self.loop)
+        await asyncio.wait([agent.shutdown() for agent in self.agents],
+                           loop=self.loop)
+
+        await self.server.stop()
+
+        return self.report(started_at)
+
+    def report(self, started_at):
+        """
+        Compute job start latency and heartbeat jitter from the events
+        recorded by the stand-in and the start times of jobs.
+        """
+        submitted = {}
+        heartbeats = defaultdict(list)
+        counts = defaultdict(int)
+
+        for ts, event, subject in self.server.events:
+            counts[event] += 1
+
+            if event == "submit":
+                submitted[subject] = ts
+            elif event == "heartbeat" and ts >= started_at:
+                heartbeats[subject].append(ts)
+
+        latencies = [ts - submitted[job_id]
+                     for job_id, ts in self.job_starts.items()
+                     if job_id in submitted]
+
+        jitter = [
+            abs(b - a - self.heartbeat_interval)
+            for timestamps in heartbeats.values()
+            for a, b in zip(timestamps, timestamps[1:])
+        ]
+
+        return {
+            "agents": self.agent_count,
+            "events": dict(counts),
+            "job_start_latency": summarize(latencies),
+            "heartbeat_jitter": summarize(jitter),
+            "loop_lag": summarize(self.lags),
+            "heartbeat_bytes": self.server.stats["bytes"]
+        }
+
+
+def _log_summary(name, stats):
+    if not stats["count"]:
+        logger.info("{0}: no samples".format(name))
+        return
+
+    logger.info("{0}: n={1} mean={2:.1f}ms p50={3:.1f}ms p99={4:.1f}ms "
+                "max={5:.1f}ms".format(name, stats["count"],
+                                       stats["mean"] * 1000,
+                                       stats["p50"] * 1000,
+                                       stats["p99"] * 1000,
+                                       stats["max"] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--agents", type=int, default=100,
+                        help="Number of simulated agents")
+    parser.add_argument("-d", "--duration", type=float, default=60.0,
+                        help="Duration of the simulation in seconds")
+    parser.add_argument("-i", "--heartbeat-interval", type=int, default=10,
+                        help="Heartbeat interval of each agent in seconds")
+    parser.add_argument("-r", "--job-rate", type=float, default=10.0,
+                        help="Jobs submitted per second across the fleet")
+    parser.add_argument("-l", "--job-lifetime", type=float, default=5.0,
+                        help="Seconds until a submitted job is killed")
+    parser.add_argument("-p", "--port", type=int, default=18888,
+                        help="Port of the cpp stand-in")
+    parser.add_argument("--no-long-poll", action="store_true",
+                        help="Dispatch jobs through heartbeats only")
+    parser.add_argument("-c", "--config", help="Configuration file path")
+    parser.add_argument("-s", "--state", help="State file path")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log output of every agent")
+    args = parser.parse_args()
+
+    configure_logging(args.verbose)
+    if not args.verbose:
+        logging.getLogger("seot.agent").setLevel(logging.WARNING)
+        logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    config.load(args.config, args.state)
+    GraphBuilder.load_node_classes()
+
+    loop = asyncio.get_event_loop()
+
+    simulator = FleetSimulator(agents=args.agents,
+                               heartbeat_interval=args.heartbeat_interval,
+                               long_poll=not args.no_long_poll,
+                               job_rate=args.job_rate,
+                               job_lifetime=args.job_lifetime,
+                               port=args.port, loop=loop)
+    report = loop.run_until_complete(simulator.run(args.duration))
+
+    logger.info("Agents: {0}, events: {1}".format(report["agents"],
+                                                  report["events"]))
+    _log_summary("Job start latency", report["job_start_latency"])
+    _log_summary("Heartbeat jitter", report["heartbeat_jitter"])
+    _log_summary("Event loop lag", report["loop_lag"])
+    logger.info("Heartbeat bytes received: {0}".format(
+        report["heartbeat_bytes"]
+    ))
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,200 @@
 import asyncio
+import time
 from abc import abstractmethod
-from logging import getLogger
+from concurrent.futures import FIRST_EXCEPTION
+from logging import DEBUG, getLogger
 
-from .. import dpp
+from .. import dpp, metrics, tracing
 from ..node import Node
 
 logger = getLogger(__name__)
 
 
+class DownstreamUnavailable(Exception):
+    """
+    Raised by _process() when the downstream of a sink cannot accept a
+    message right now
+    """
+    pass
+
+
 class BaseSink(Node):
-    def __init__(self, qsize=0, **kwargs):
+    # Whether traced messages end at this node (see tracing.finish)
+    _ends_traces = True
+
+    def __init__(self, qsize=0, spill_dir=None,
+                 spill_max_bytes=64 * 1024 * 1024, replay_rate=100,
+                 retry_interval=5, **kwargs):
+        """
+        Initialize this sink. Argument qsize limits the number of queued
+        messages. If spill_dir is given, messages which cannot be delivered
+        because the downstream is unavailable are spilled to disk (up to
+        spill_max_bytes) and replayed in order at replay_rate messages per
+        second once it recovers; delivery is retried every retry_interval
+        seconds. Otherwise such messages are dropped. New messages are
+        spilled as well until the spill is empty, and replay keeps up with
+        them on top of replay_rate, so the spill drains at replay_rate as
+        long as the downstream accepts messages fast enough.
+        """
         super().__init__(**kwargs)
         self._queue = asyncio.Queue(maxsize=qsize, loop=self.loop)
+        self._process_metric = "node.{0}.process".format(self.name)
+
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.replay_rate = replay_rate
+        self.retry_interval = retry_interval
+        self._spill = None
 
-    async def write(self, data):
-        logger.debug("Node {0} of type {1} received:\n{2}".format(
-            self.name,
-            self.__class__.__name__,
-            dpp.format(data))
-        )
+    async def write(self, data, sender=None):
+        """
+        Queue data for processing. Argument sender is the name of the node
+        which emitted data, if known.
+        """
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Node {0} of type {1} received:\n{2}".format(
+                self.name,
+                self.__class__.__name__,
+                dpp.format(data))
+            )
 
+        trace = tracing.get(data)
+        if trace is not None:
+            tracing.enqueued(trace, self.name)
+
+        await self._enqueue(data, sender)
+
+    async def _enqueue(self, data, sender):
         await self._queue.put(data)
 
     @abstractmethod
     async def _process(self, data):
         pass
 
+    async def _invoke(self, data):
+        """
+        Call _process() while recording its duration and attributing errors
+        to this node.
+        """
+        trace = tracing.get(data)
+        if trace is not None:
+            tracing.dequeued(trace, self.name)
+
+        start = time.perf_counter()
+        try:
+            output_data = await self._process(data)
+            if trace is not None and self._ends_traces:
+                tracing.finish(trace, self.name)
+            return output_data
+        except DownstreamUnavailable:
+            raise
+        except Exception as e:
+            logger.error("Node {0} of type {1} failed: {2}".format(
+                self.name, self.__class__.__name__, e
+            ))
+            raise
+        finally:
+            metrics.observe(self._process_metric, time.perf_counter() - start)
+
+    def _update_spill_metrics(self, lag=0.0):
+        metrics.set_gauge("node.{0}.spill.depth".format(self.name),
+                          len(self._spill))
+        metrics.set_gauge("node.{0}.spill.bytes".format(self.name),
+                          self._spill.size)
+        metrics.set_gauge("node.{0}.spill.replay_lag".format(self.name), lag)
+
+    async def _replay(self):
+        interval = 1.0 / self.replay_rate
+
+        while True:
+            head = self._spill.peek()
+            if head is None:
+                self._spilled.clear()
+                await self._spilled.wait()
+                continue
+
+            timestamp, data = head
+            position = self._spill.head_position
+            try:
+                await self._invoke(data)
+            except DownstreamUnavailable:
+                self._spilled_while_replaying = 0
+                await asyncio.sleep(self.retry_interval, loop=self.loop)
+                continue
+
+            # The head may have been dropped to make room while delivering
+            if self._spill.head_position == position:
+                self._spill.pop()
+            self._update_spill_metrics(time.time() - timestamp)
+
+            # Messages spilled since the downstream recovered are replayed
+            # without pacing; otherwise the sink could not catch up with
+            # input faster than replay_rate until the spill is full
+            if self._spilled_while_replaying:
+                self._spilled_while_replaying -= 1
+                await asyncio.sleep(0, loop=self.loop)
+            else:
+                await asyncio.sleep(interval, loop=self.loop)
+
+    def _spill_message(self, data):
+        if not len(self._spill):
+            logger.warning("Downstream of node {0} is unavailable; spilling "
+                           "to {1}".format(self.name, self.spill_dir))
+
+        self._spill.append(data)
+        self._spilled_while_replaying += 1
+        self._spilled.set()
+        self._update_spill_metrics()
+
+    async def _run_with_spill(self):
+        from ..spill import SpillQueue
+
+        self._spill = SpillQueue(self.spill_dir,
+                                 max_bytes=self.spill_max_bytes)
+        self._spilled = asyncio.Event(loop=self.loop)
+        # Messages spilled while the downstream accepts replayed ones; each
+        # lets one replayed message skip pacing
+        self._spilled_while_replaying = 0
+        if len(self._spill):
+            self._spilled.set()
+
+        tasks = [asyncio.ensure_future(self._deliver_or_spill(),
+                                       loop=self.loop),
+                 asyncio.ensure_future(self._replay(), loop=self.loop)]
+        try:
+            done, _ = await asyncio.wait(tasks, loop=self.loop,
+                                         return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._spill.close()
+
+    async def _deliver_or_spill(self):
+        while True:
+            input_data = await self._queue.get()
+
+            # Keep messages in order while spilled ones are pending
+            if len(self._spill):
+                self._spill_message(input_data)
+                continue
+
+            try:
+                await self._invoke(input_data)
+            except DownstreamUnavailable:
+                self._spill_message(input_data)
+
     async def _run(self):
+        if self.spill_dir is not None:
+            await self._run_with_spill()
+            return
+
         while True:
             input_data = await self._queue.get()
-            await self._process(input_data)
+            try:
+                await self._invoke(input_data)
+            except DownstreamUnavailable as e:
+                logger.error("Node {0} dropped a message: {1}".format(
+                    self.name, e
+                ))
@@ -5,6 +5,7 @@ from pathlib import Path
 import aiofiles
 
 from . import BaseSink
+from ..blobs import Blob
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +29,9 @@ class FileSystemSink(BaseSink):
 
         data = msg[self.data_key]
 
-        if not isinstance(data, bytes):
+        if isinstance(data, Blob):
+            data = data.view()
+        elif not isinstance(data, bytes):
             return
 
         path = self.dest / (self.prefix + str(self.serial) + self.postfix)
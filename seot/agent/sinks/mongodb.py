@@ -1,4 +1,3 @@
-import copy
 import logging
 
 
@@ -6,7 +5,8 @@ import motor.motor_asyncio
 
 from pymongo.errors import ConnectionFailure
 
-from . import BaseSink
+from . import BaseSink, DownstreamUnavailable
+from ..blobs import materialize
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +26,11 @@ class MongoDBSink(BaseSink):
 
     async def _process(self, data):
         try:
-            # Need deepcopy here because db.collection.insert() modifies
+            # Need a copy here because db.collection.insert() modifies
             # the object being inserted
-            await self.collection.insert(copy.deepcopy(data))
+            await self.collection.insert(materialize(data))
         except ConnectionFailure as e:
-            logger.error("Connection error: {0}".format(e))
+            raise DownstreamUnavailable("Connection error: {0}".format(e))
 
     async def startup(self):
         logger.info("Trying to connect to MongoDB...")
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import time
+from logging import getLogger
+from pathlib import Path
+
+from . import BaseSink
+from .. import metrics, timeseries
+from ..scheduler import get_scheduler
+
+logger = getLogger(__name__)
+
+
+class RingStoreSink(BaseSink):
+    def __init__(self, fields=None, max_bytes=1024 * 1024, store_name=None,
+                 snapshot_path=None, snapshot_interval=60, http_port=None,
+                 http_host="127.0.0.1", **kwargs):
+        """
+        Initialize this sink. The latest values of fields are kept in a
+        TimeSeriesRing of max_bytes bytes, registered in seot.agent.timeseries
+        as store_name (the node name by default). If snapshot_path is given,
+        the records are written there every snapshot_interval seconds and on
+        cleanup, and loaded again on startup. If http_port is given, the
+        records can be queried over HTTP:
+
+            GET /latest?n=N
+            GET /range?start=T&end=T
+            GET /downsample?bucket=S&start=T&end=T&aggregate=mean|min|max|last
+        """
+        super().__init__(**kwargs)
+        self.ring = timeseries.TimeSeriesRing(fields, max_bytes)
+        self.store_name = store_name or self.name
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.http_port = http_port
+        self.http_host = http_host
+
+        self._out_of_order_metric = "node.{0}.out_of_order".format(self.name)
+        self._snapshot_task = None
+        self._app = None
+        self._handler = None
+        self._server = None
+
+    async def startup(self):
+        if self.snapshot_path is not None:
+            await self._load_snapshot()
+            if self.snapshot_interval:
+                self._snapshot_task = asyncio.ensure_future(
+                    self._snapshot_periodically(), loop=self.loop
+                )
+
+        timeseries.register(self.store_name, self.ring)
+
+        if self.http_port is not None:
+            await self._start_http()
+
+    async def cleanup(self):
+        timeseries.unregister(self.store_name, self.ring)
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            await self._app.shutdown()
+            await self._handler.finish_connections(1.0)
+            await self._app.cleanup()
+
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            await asyncio.wait([self._snapshot_task], loop=self.loop)
+
+        if self.snapshot_path is not None:
+            await self._save_snapshot()
+
+    async def _process(self, data):
+        timestamp = data.get("meta", {}).get("timestamp") or time.time()
+
+        if not self.ring.append(timestamp, data):
+            metrics.incr(self._out_of_order_metric)
+
+    async def _load_snapshot(self):
+        path = Path(self.snapshot_path)
+        if not path.is_file():
+            return
+
+        try:
+            data = await self.loop.run_in_executor(None, path.read_bytes)
+            if self.ring.restore(data):
+                logger.info("Restored {0} records from {1}".format(
+                    len(self.ring), path
+                ))
+            else:
+                logger.warning("Ignoring snapshot {0} with different fields"
+                               .format(path))
+        except ValueError as e:
+            logger.warning("Ignoring malformed snapshot {0} and starting "
+                           "empty: {1}".format(path, e))
+        except OSError as e:
+            logger.error("Failed to load snapshot {0}: {1}".format(path, e))
+
+    async def _save_snapshot(self):
+        # Serialize on the event loop so that no record is appended meanwhile
+        data = self.ring.dump()
+
+        try:
+            await self.loop.run_in_executor(None, _write_atomically,
+                                            Path(self.snapshot_path), data)
+        except OSError as e:
+            logger.error("Failed to write snapshot {0}: {1}".format(
+                self.snapshot_path, e
+            ))
+
+    async def _snapshot_periodically(self):
+        ticker = get_scheduler(self.loop).subscribe(
+            self.snapshot_interval, name=self.name
+        )
+        try:
+            while True:
+                await ticker.wait()
+                await self._save_snapshot()
+        finally:
+            ticker.cancel()
+
+    async def _start_http(self):
+        # aiohttp is only needed when the query API is enabled
+        from aiohttp import web
+
+        self._app = web.Application(loop=self.loop)
+        for path, query in (("/latest", self._latest),
+                            ("/range", self._range),
+                            ("/downsample", self._downsample)):
+            self._app.router.add_get(path, _query_handler(web, query))
+
+        self._handler = self._app.make_handler()
+        self._server = await self.loop.create_server(
+            self._handler, self.http_host, self.http_port
+        )
+        logger.info("Serving {0} at http://{1}:{2}".format(
+            self.store_name, self.http_host, self.http_port
+        ))
+
+    def _latest(self, params):
+        return self.ring.latest(int(params.get("n", 1)))
+
+    def _range(self, params):
+        return self.ring.range(_float_or_none(params.get("start")),
+                               _float_or_none(params.get("end")))
+
+    def _downsample(self, params):
+        return self.ring.downsample(float(params["bucket"]),
+                                    _float_or_none(params.get("start")),
+                                    _float_or_none(params.get("end")),
+                                    params.get("aggregate", "mean"))
+
+    @classmethod
+    def can_run(cls):
+        return True
+
+
+def _float_or_none(value):
+    return None if value is None else float(value)
+
+
+def _query_handler(web, query):
+    async def _handler(request):
+        try:
+            return web.json_response(query(request.GET))
+        except (KeyError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+    return _handler
+
+
+def _write_atomically(path, data):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(data)
+    os.replace(str(tmp_path), str(path))
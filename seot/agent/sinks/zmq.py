@@ -1,35 +1,67 @@
 import logging
 
 import zmq
-import zmq.asyncio
 
-from . import BaseSink
+from . import BaseSink, DownstreamUnavailable
+from .. import transport
 from ..dpp import encode
 
 logger = logging.getLogger(__name__)
 
 
 class ZMQSink(BaseSink):
-    def __init__(self, url="tcp://127.0.0.1:51423", linger=100, **kwargs):
+    def __init__(self, url="tcp://127.0.0.1:51423", linger=100, hwm=1000,
+                 local_handoff=True, **kwargs):
+        """
+        Initialize this sink. If local_handoff is True and a ZMQSource of
+        this process is bound to url, messages are handed over to it directly
+        instead of being sent through the socket. Sending waits while the
+        peer is not connected or cannot keep up, unless spilling is enabled
+        (see BaseSink), in which case such messages are spilled.
+        """
         super().__init__(**kwargs)
         self.url = url
         self.linger = linger
-        self.ctx = zmq.asyncio.Context()
+        self.hwm = hwm
+        self.local_handoff = local_handoff
+        self.ctx = transport.get_context()
+        self._endpoint = transport.endpoint_key(url)
 
     async def startup(self):
         self.sock = self.ctx.socket(zmq.PUSH, io_loop=self.loop)
         self.sock.setsockopt(zmq.LINGER, self.linger)
+        self.sock.setsockopt(zmq.SNDHWM, self.hwm)
+        if self.spill_dir is not None:
+            # Spill messages for peers which are not connected yet instead of
+            # queueing them in the socket
+            self.sock.setsockopt(zmq.IMMEDIATE, 1)
         logger.info("Connecting to ZMQ peer at {0}".format(self.url))
         self.sock.connect(self.url)
 
     async def cleanup(self):
         self.sock.close()
         logger.info("Closed ZMQ socket")
-        self.ctx.term()
-        logger.info("Terminated ZMQ context")
 
     async def _process(self, msg):
-        self.sock.send(encode(msg))
+        if self.local_handoff:
+            peer = transport.local_peer(self._endpoint)
+            if peer is not None:
+                if self.spill_dir is None:
+                    await peer.deliver(msg)
+                elif not peer.handoff(msg):
+                    raise DownstreamUnavailable("Local ZMQ peer at {0} is "
+                                                "not ready".format(self.url))
+                return
+
+        if self.spill_dir is None:
+            await self.sock.send(encode(msg))
+            return
+
+        try:
+            await self.sock.send(encode(msg), flags=zmq.NOBLOCK)
+        except zmq.Again:
+            raise DownstreamUnavailable("ZMQ peer at {0} is not ready"
+                                        .format(self.url))
 
     @classmethod
     def can_run(cls):
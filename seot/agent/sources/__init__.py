@@ -1,19 +1,48 @@
 import asyncio
+import functools
+import random
 import time
-from logging import getLogger
+from abc import abstractmethod
+from logging import DEBUG, getLogger
 
-from .. import config, dpp
+from .. import blobs, config, dpp, records, tracing
+from ..devices import get_hub, in_use
 from ..node import Node
+from ..scheduler import get_scheduler
 from ..sinks import BaseSink
 
 logger = getLogger(__name__)
 
 
 class BaseSource(Node):
-    def __init__(self, **kwargs):
+    META_MODES = ("record", "stream")
+
+    def __init__(self, meta_mode="record", trace_rate=None, **kwargs):
+        """
+        Initialize this source. Argument meta_mode controls how agent-level
+        metadata is attached to emitted messages: "record" attaches it to
+        every message, "stream" attaches it only to the first message and
+        stamps a bare timestamp on the following ones. Argument trace_rate
+        is the fraction of messages originating here which carry a trace
+        context (tracing.sample_rate by default).
+        """
         super().__init__(**kwargs)
         self._next_nodes = []
 
+        if meta_mode not in self.META_MODES:
+            raise ValueError("meta_mode must be one of {0}".format(
+                ", ".join(self.META_MODES)
+            ))
+        self.meta_mode = meta_mode
+        self._meta_template = config.get_agent_meta()
+        self._meta_sent = False
+
+        if trace_rate is None:
+            trace_rate = config.get("tracing.sample_rate") or 0.0
+        self.trace_rate = trace_rate
+
+        self._blob_store = blobs.get_store()
+
     def connect(self, node):
         if not isinstance(node, BaseSink):
             raise ValueError("Expected a sink")
@@ -22,25 +51,199 @@ class BaseSource(Node):
 
         return node
 
-    async def _emit(self, data):
-        logger.debug("Node {0} of type {1} emitted:\n{2}".format(
-            self.name,
-            self.__class__.__name__,
-            dpp.format(data))
-        )
+    async def _emit(self, data, sender=None):
+        """
+        Pass data to the next nodes. Argument sender is the name reported as
+        the sender of data (the name of this node by default).
+        """
+        if sender is None:
+            sender = self.name
+
+        if self._blob_store is not None:
+            self._blob_store.externalize(data)
+
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Node {0} of type {1} emitted:\n{2}".format(
+                self.name,
+                self.__class__.__name__,
+                dpp.format(data))
+            )
 
         if "meta" not in data:
-            data["meta"] = {
-                "agent_id": config.get_state("agent_id"),
-                "longitude": config.get("agent.coordinate.longitude"),
-                "latitude": config.get("agent.coordinate.latitude"),
-                "timestamp": time.time()
-            }
+            self._stamp_meta(data)
 
         if not self._next_nodes:
             return
-        await asyncio.wait([node.write(data) for node in self._next_nodes],
-                           loop=self.loop)
+
+        if len(self._next_nodes) > 1 and tracing.get(data) is not None:
+            # Give each branch its own copy of the trace
+            await asyncio.wait([node.write(tracing.fork(data),
+                                           sender=sender)
+                                for node in self._next_nodes], loop=self.loop)
+            return
+
+        await asyncio.wait([node.write(data, sender=sender)
+                            for node in self._next_nodes], loop=self.loop)
+
+    def _stamp_meta(self, data, sample=True):
+        """
+        Attach metadata to data. Unless sample is False, a new trace is
+        started for a trace_rate fraction of messages.
+        """
+        if self.meta_mode == "record" or not self._meta_sent:
+            template = self._meta_template
+            self._meta_sent = True
+        else:
+            template = None
+
+        if isinstance(data, records.Record):
+            meta = records.make_meta(template)
+        else:
+            meta = template.copy() if template else {}
+            meta["timestamp"] = time.time()
+
+        if sample and self.trace_rate and random.random() < self.trace_rate:
+            tracing.start(meta)
+        data["meta"] = meta
 
     def next_nodes(self):
         return self._next_nodes
+
+
+class PeriodicSource(BaseSource):
+    """
+    Base class of sources that produce a message every interval seconds.
+    Ticks come from the event loop's shared TimerScheduler, so the period
+    does not drift by the time spent producing a message.
+    """
+    def __init__(self, interval=1, phase=0, jitter=0, **kwargs):
+        """
+        Initialize this source. Ticks fall on multiples of interval offset by
+        phase seconds plus a random offset of up to jitter seconds. An
+        interval of zero produces messages as fast as possible.
+        """
+        super().__init__(**kwargs)
+        self.interval = interval
+        self.phase = phase
+        self.jitter = jitter
+        self.ticker = None
+
+    @abstractmethod
+    async def _poll(self):
+        """
+        Coroutine returning the next message, or None to skip this tick.
+        Must be overridden by subclasses.
+        """
+        pass
+
+    async def _run(self):
+        if not self.interval:
+            while True:
+                await self._poll_and_emit()
+                await asyncio.sleep(0, loop=self.loop)
+
+        self.ticker = get_scheduler(self.loop).subscribe(
+            self.interval, phase=self.phase, jitter=self.jitter,
+            name=self.name
+        )
+        try:
+            while True:
+                await self._poll_and_emit()
+                await self.ticker.wait()
+        finally:
+            self.ticker.cancel()
+
+    async def _poll_and_emit(self):
+        data = await self._poll()
+        if data is not None:
+            await self._emit(data)
+
+
+class DeviceSource(PeriodicSource):
+    """
+    Base class of sources reading a hardware device. Sources of the same
+    device in all jobs of the agent share one reader (see
+    seot.agent.devices), which polls the device at the shortest interval of
+    its sources and passes readings to each source at its own interval,
+    rounded to a multiple of the shortest one. The device is opened by the
+    first source and closed when the last one stops, and the phase and
+    jitter of the first source apply to all of them.
+    """
+    # Key identifying the device shared by sources of this type
+    device = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.subscription = None
+
+    def _device_options(self):
+        """
+        Return the options used to open and read the device. Sources whose
+        options differ from those of the device's first source get readings
+        made with the latter.
+        """
+        return {}
+
+    @classmethod
+    @abstractmethod
+    def _open_device(cls, options):
+        """
+        Open the device and return its handle. Called in an executor. Must
+        be overridden by subclasses.
+        """
+        pass
+
+    @classmethod
+    @abstractmethod
+    async def _read_device(cls, handle, options):
+        """
+        Coroutine returning a reading of the device, or None to skip it.
+        Must be overridden by subclasses.
+        """
+        pass
+
+    @classmethod
+    def _close_device(cls, handle, options):
+        """
+        Close the device handle returned by _open_device().
+        """
+        pass
+
+    @classmethod
+    def _device_in_use(cls):
+        """
+        Return whether a source of the agent has the device open. Probing
+        the device in can_run() would fail then, as it can only be opened
+        once.
+        """
+        return in_use(cls.device)
+
+    @abstractmethod
+    def _convert(self, reading):
+        """
+        Return a new message built from a reading, which is shared with the
+        other sources of the device. Must be overridden by subclasses.
+        """
+        pass
+
+    async def _poll(self):
+        return self._convert(await self.subscription.get())
+
+    async def _run(self):
+        cls = type(self)
+        options = self._device_options()
+
+        self.subscription = get_hub(self.loop).subscribe(
+            self.device,
+            functools.partial(cls._open_device, options),
+            functools.partial(cls._read_device, options=options),
+            functools.partial(cls._close_device, options=options),
+            interval=self.interval, phase=self.phase, jitter=self.jitter,
+            options=options, name=self.name
+        )
+        try:
+            while True:
+                await self._poll_and_emit()
+        finally:
+            self.subscription.close()
+            self.subscription = None
@@ -1,18 +1,16 @@
-import asyncio
+import copy
 
-from . import BaseSource
+from . import PeriodicSource
 
 
-class ConstSource(BaseSource):
-    def __init__(self, const=None, interval=1, **kwargs):
+class ConstSource(PeriodicSource):
+    def __init__(self, const=None, **kwargs):
         super().__init__(**kwargs)
         self.const = const
-        self.interval = interval
 
-    async def _run(self):
-        while True:
-            await self._emit(self.const)
-            await asyncio.sleep(self.interval, loop=self.loop)
+    async def _poll(self):
+        # Emit a fresh message so that each gets its own meta
+        return copy.copy(self.const)
 
     @classmethod
     def can_run(cls):
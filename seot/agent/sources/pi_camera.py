@@ -4,37 +4,62 @@ from io import BytesIO
 
 from picamera import PiCamera
 
-from . import BaseSource
+from . import DeviceSource
 
 logger = logging.getLogger(__name__)
 
 
-class PiCameraSource(BaseSource):
+class PiCameraSource(DeviceSource):
+    device = "picamera"
+
     def __init__(self, interval=10, width=640, height=480, fmt="jpeg",
                  **kwargs):
-        super().__init__(**kwargs)
-        self.interval = interval
-        self.camera = PiCamera()
-        self.camera.resolution = (width, height)
+        super().__init__(interval=interval, **kwargs)
+        self.width = width
+        self.height = height
         self.fmt = fmt
 
-    async def cleanup(self):
-        self.camera.close()
+    def _device_options(self):
+        return {
+            "resolution": (self.width, self.height),
+            "fmt": self.fmt
+        }
+
+    @classmethod
+    def _open_device(cls, options):
+        camera = PiCamera()
+        camera.resolution = options["resolution"]
 
-    async def _run(self):
-        while True:
-            with BytesIO() as b:
-                self.camera.capture(b, self.fmt)
+        return camera
 
-                data = {
-                    "image": b.getvalue()
-                }
-                await self._emit(data)
+    @staticmethod
+    def _capture(camera, fmt):
+        with BytesIO() as b:
+            camera.capture(b, fmt)
 
-            await asyncio.sleep(self.interval, loop=self.loop)
+            return b.getvalue()
+
+    @classmethod
+    async def _read_device(cls, camera, options):
+        # Capturing takes hundreds of milliseconds
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, cls._capture, camera,
+                                          options["fmt"])
+
+    @classmethod
+    def _close_device(cls, camera, options):
+        camera.close()
+
+    def _convert(self, reading):
+        return {
+            "image": reading
+        }
 
     @classmethod
     def can_run(cls):
+        if cls._device_in_use():
+            return True
+
         try:
             camera = PiCamera()
             camera.close()
@@ -3,30 +3,57 @@ import logging
 
 from sense_hat import SenseHat
 
-from . import BaseSource
+from . import DeviceSource
+from ..records import record_type
 
 logger = logging.getLogger(__name__)
 
+Reading = record_type(("temperature", "humidity", "pressure"),
+                      name="SenseHatReading")
 
-class SenseHatSource(BaseSource):
-    def __init__(self, interval=5, **kwargs):
-        super().__init__(**kwargs)
-        self.interval = interval
-        self.sense = SenseHat()
 
-    async def _run(self):
-        while True:
-            data = {
-                "temperature": self.sense.get_temperature(),
-                "humidity": self.sense.get_humidity(),
-                "pressure": self.sense.get_pressure()
-            }
-            await self._emit(data)
+class SenseHatSource(DeviceSource):
+    device = "sense_hat"
 
-            await asyncio.sleep(self.interval, loop=self.loop)
+    def __init__(self, interval=5, compact=False, **kwargs):
+        """
+        Initialize this source. If compact is True, readings are emitted as
+        records (see seot.agent.records) instead of dicts.
+        """
+        super().__init__(interval=interval, **kwargs)
+        self.compact = compact
+
+    @classmethod
+    def _open_device(cls, options):
+        return SenseHat()
+
+    @staticmethod
+    def _read_sensors(sense):
+        return (sense.get_temperature(),
+                sense.get_humidity(),
+                sense.get_pressure())
+
+    @classmethod
+    async def _read_device(cls, sense, options):
+        # Reading the sensors over I2C blocks
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, cls._read_sensors, sense)
+
+    def _convert(self, reading):
+        if self.compact:
+            return Reading(*reading)
+
+        return {
+            "temperature": reading[0],
+            "humidity": reading[1],
+            "pressure": reading[2]
+        }
 
     @classmethod
     def can_run(cls):
+        if cls._device_in_use():
+            return True
+
         try:
             sense = SenseHat()
             sense.get_temperature()
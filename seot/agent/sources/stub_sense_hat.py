@@ -1,38 +1,70 @@
-import asyncio
 import logging
 import random
+import time
 
-from . import BaseSource
+from . import DeviceSource
+from ..records import record_type
 
 logger = logging.getLogger(__name__)
 
+Reading = record_type(("temperature", "humidity", "pressure"),
+                      name="SenseHatReading")
 
-class StubSenseHatSource(BaseSource):
-    def __init__(self, interval=5, **kwargs):
-        super().__init__(**kwargs)
-        self.interval = interval
 
-        # These synthetic values are generated based on Wiener process
+class _StubSenseHat:
+    """ Synthetic sensor values generated based on Wiener process """
+    def __init__(self):
         self.temperature = 25.0
         self.humidity = 50.0
         self.pressure = 1013.0
+        self.last_read = None
 
-    async def _run(self):
-        while True:
-            sigma = self.interval / 100.0
+    def read(self):
+        now = time.monotonic()
+        elapsed = 0.0 if self.last_read is None else now - self.last_read
+        self.last_read = now
 
+        sigma = elapsed / 100.0
+        if sigma:
             self.temperature = random.gauss(self.temperature, sigma)
             self.humidity = random.gauss(self.humidity, sigma)
             self.pressure = random.gauss(self.pressure, sigma)
 
-            data = {
-                "temperature": self.temperature,
-                "humidity": self.humidity,
-                "pressure": self.pressure
-            }
-            await self._emit(data)
+        return (self.temperature, self.humidity, self.pressure)
 
-            await asyncio.sleep(self.interval, loop=self.loop)
+
+class StubSenseHatSource(DeviceSource):
+    """
+    Stand-in for SenseHatSource producing synthetic values. Like the real
+    device, the stub sensor is shared by all sources of this type.
+    """
+    device = "stub_sense_hat"
+
+    def __init__(self, interval=5, compact=False, **kwargs):
+        """
+        Initialize this source. If compact is True, readings are emitted as
+        records (see seot.agent.records) instead of dicts.
+        """
+        super().__init__(interval=interval, **kwargs)
+        self.compact = compact
+
+    @classmethod
+    def _open_device(cls, options):
+        return _StubSenseHat()
+
+    @classmethod
+    async def _read_device(cls, sensor, options):
+        return sensor.read()
+
+    def _convert(self, reading):
+        if self.compact:
+            return Reading(*reading)
+
+        return {
+            "temperature": reading[0],
+            "humidity": reading[1],
+            "pressure": reading[2]
+        }
 
     @classmethod
     def can_run(cls):
@@ -1,34 +1,98 @@
+import asyncio
 import logging
+from concurrent.futures import FIRST_EXCEPTION
 
 import zmq
-import zmq.asyncio
 
 from . import BaseSource
+from .. import tracing, transport
 from ..dpp import decode
+from ..records import record_type
 
 logger = logging.getLogger(__name__)
 
 
 class ZMQSource(BaseSource):
-    def __init__(self, url="tcp://0.0.0.0:51423", **kwargs):
+    def __init__(self, url="tcp://0.0.0.0:51423", hwm=1000, schema=None,
+                 sender=None, **kwargs):
+        """
+        Initialize this source. Argument hwm limits the number of queued
+        messages, both received from the socket and handed over by ZMQSinks
+        of this process. If the peer sends records (see seot.agent.records),
+        schema lists their field names to decode them into records again.
+        Argument sender is the name reported to the next nodes as the sender
+        of received messages (the name of this node by default), e.g. the
+        upstream node of a link between graph partitions.
+        """
         super().__init__(**kwargs)
         self.url = url
-        self.ctx = zmq.asyncio.Context()
+        self.sender = sender
+        self.hwm = hwm
+        self.schema = record_type(schema) if schema else None
+        self.ctx = transport.get_context()
+        self._handoff_queue = asyncio.Queue(maxsize=hwm, loop=self.loop)
 
     async def startup(self):
         self.sock = self.ctx.socket(zmq.PULL)
+        self.sock.setsockopt(zmq.RCVHWM, self.hwm)
         self.sock.bind(self.url)
+        transport.register(self.url, self)
         logger.info("ZMQ listening at {0}".format(self.url))
 
     async def cleanup(self):
+        transport.unregister(self.url, self)
         self.sock.unbind(self.url)
         self.sock.close()
         logger.info("Closed ZMQ socket")
 
-    async def _run(self):
+    def handoff(self, data):
+        """
+        Accept a message from a ZMQSink of this process without going
+        through the socket. The message is copied down to its metadata (see
+        transport.copy_message()). Returns False if the message cannot be
+        accepted right now.
+        """
+        if not self.running() or self._handoff_queue.full():
+            return False
+
+        self._handoff_queue.put_nowait(transport.copy_message(data))
+        return True
+
+    async def deliver(self, data):
+        """
+        Like handoff(), but wait until the message can be queued.
+        """
+        await self._handoff_queue.put(transport.copy_message(data))
+
+    async def _emit_received(self, data):
+        trace = tracing.get(data)
+        if trace is not None:
+            tracing.passed(trace, self.name)
+
+        await self._emit(data, sender=self.sender)
+
+    async def _receive(self):
+        while True:
+            data = decode(await self.sock.recv(), self.schema)
+            await self._emit_received(data)
+
+    async def _receive_handoff(self):
         while True:
-            data = await self.sock.recv()
-            await self._emit(decode(data))
+            data = await self._handoff_queue.get()
+            await self._emit_received(data)
+
+    async def _run(self):
+        tasks = [asyncio.ensure_future(self._receive(), loop=self.loop),
+                 asyncio.ensure_future(self._receive_handoff(),
+                                       loop=self.loop)]
+        try:
+            done, _ = await asyncio.wait(tasks, loop=self.loop,
+                                         return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+        finally:
+            for task in tasks:
+                task.cancel()
 
     @classmethod
     def can_run(cls):
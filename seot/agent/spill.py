@@ -0,0 +1,228 @@
+import os
+import struct
+import time
+from collections import deque
+from logging import getLogger
+from pathlib import Path
+
+from . import dpp, records
+
+logger = getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+
+
+class SpillQueue:
+    """
+    A bounded, persistent FIFO of messages backed by a directory of
+    append-only segment files. When the total size exceeds max_bytes, the
+    oldest segments are dropped. Records of a partially consumed segment are
+    replayed again after a restart (at-least-once delivery). Compact records
+    (see seot.agent.records) are stored with their schema and come back as
+    records of the same fields.
+    """
+    SEGMENT_SUFFIX = ".seg"
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024,
+                 segment_bytes=1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        # Number of records dropped because the queue was full
+        self.dropped = 0
+
+        # Each segment is a dict with keys seq, size and records (number of
+        # unconsumed records)
+        self._segments = deque()
+        self._count = 0
+        self._bytes = 0
+        self._writer = None
+        self._reader = None
+        self._head = None
+        # Number of records removed from the head, popped or dropped
+        self._removed = 0
+
+        os.makedirs(str(self.path), exist_ok=True)
+        self._recover()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size(self):
+        """ Total size of segment files in bytes """
+        return self._bytes
+
+    @property
+    def head_position(self):
+        """
+        Position of the oldest message since this queue was opened. It
+        changes whenever the oldest message is popped or dropped, so callers
+        which deliver a peeked message can tell if it is still the head.
+        """
+        return self._removed
+
+    def _segment_path(self, seq):
+        return self.path / "{0:016d}{1}".format(seq, self.SEGMENT_SUFFIX)
+
+    def _recover(self):
+        paths = sorted(self.path.glob("*" + self.SEGMENT_SUFFIX))
+
+        for path in paths:
+            records = 0
+            offset = 0
+            with path.open("rb") as f:
+                while True:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    length, = _HEADER.unpack(header)
+                    if len(f.read(length)) < length:
+                        break
+                    offset += _HEADER.size + length
+                    records += 1
+
+            # Drop a torn record left by a crash in the middle of a write
+            if offset != path.stat().st_size:
+                with path.open("r+b") as f:
+                    f.truncate(offset)
+
+            if records == 0:
+                path.unlink()
+                continue
+
+            self._segments.append({
+                "seq": int(path.stem),
+                "size": offset,
+                "records": records
+            })
+            self._count += records
+            self._bytes += offset
+
+        if self._count:
+            logger.info("Recovered {0} spilled records from {1}".format(
+                self._count, self.path
+            ))
+
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+
+        seq = self._segments[-1]["seq"] + 1 if self._segments else 0
+        self._segments.append({"seq": seq, "size": 0, "records": 0})
+        self._writer = self._segment_path(seq).open("ab")
+
+    def _remove_head_segment(self):
+        segment = self._segments.popleft()
+
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self._head = None
+
+        if not self._segments and self._writer is not None:
+            # This was also the segment being written
+            self._writer.close()
+            self._writer = None
+
+        self._count -= segment["records"]
+        self._bytes -= segment["size"]
+        self._removed += segment["records"]
+        self._segment_path(segment["seq"]).unlink()
+
+        return segment
+
+    def append(self, data, timestamp=None):
+        """
+        Append a message to the tail of this queue.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        entry = [timestamp, data]
+        if isinstance(data, records.Record):
+            # Records are encoded as bare arrays, so keep their schema
+            entry.append([list(data._fields), list(data._optional)])
+
+        payload = dpp.encode(entry)
+        record = _HEADER.pack(len(payload)) + payload
+
+        if self._writer is None or \
+                self._segments[-1]["size"] + len(record) > self.segment_bytes:
+            self._roll()
+
+        self._writer.write(record)
+        self._writer.flush()
+
+        segment = self._segments[-1]
+        segment["size"] += len(record)
+        segment["records"] += 1
+        self._count += 1
+        self._bytes += len(record)
+
+        while self._bytes > self.max_bytes and len(self._segments) > 1:
+            dropped = self._remove_head_segment()
+            self.dropped += dropped["records"]
+            logger.warning("Spill queue {0} is full; dropped {1} records"
+                           .format(self.path, dropped["records"]))
+
+    @staticmethod
+    def _decode(payload):
+        entry = dpp.decode(payload)
+        timestamp, data = entry[:2]
+
+        if len(entry) > 2:
+            fields, optional = entry[2]
+            data = records.decode(data, records.record_type(
+                fields, optional=optional
+            ))
+
+        return timestamp, data
+
+    def peek(self):
+        """
+        Return the oldest message and the time it was spilled as a tuple
+        (timestamp, data), or None if this queue is empty.
+        """
+        if not self._count:
+            return None
+
+        if self._head is None:
+            if self._reader is None:
+                segment = self._segments[0]
+                self._reader = self._segment_path(segment["seq"]).open("rb")
+
+            length, = _HEADER.unpack(self._reader.read(_HEADER.size))
+            self._head = self._decode(self._reader.read(length))
+
+        return self._head
+
+    def pop(self):
+        """
+        Remove and return the oldest message as a tuple (timestamp, data).
+        """
+        head = self.peek()
+        if head is None:
+            raise IndexError("pop from an empty spill queue")
+
+        self._head = None
+        segment = self._segments[0]
+        segment["records"] -= 1
+        self._count -= 1
+        self._removed += 1
+
+        if segment["records"] == 0:
+            self._remove_head_segment()
+
+        return head
+
+    def close(self):
+        """
+        Close open segment files.
+        """
+        for f in (self._reader, self._writer):
+            if f is not None:
+                f.close()
+        self._reader = None
+        self._writer = None
+        self._head = None
@@ -0,0 +1,250 @@
+"""
+Fixed-size in-memory store of numeric time series
+"""
+import json
+import math
+import struct
+from array import array
+
+# Bytes per stored value (array typecode "d")
+_ITEM_SIZE = 8
+_HEADER = struct.Struct(">I")
+
+# Name -> TimeSeriesRing, for looking up stores from other parts of the agent
+_stores = {}
+
+AGGREGATES = ("mean", "min", "max", "last")
+
+
+def lookup(name):
+    """ Return the store registered under name, or None """
+    return _stores.get(name)
+
+
+def register(name, ring):
+    _stores[name] = ring
+
+
+def unregister(name, ring):
+    if _stores.get(name) is ring:
+        del _stores[name]
+
+
+class TimeSeriesRing:
+    """
+    Keeps the latest records of a set of numeric fields in preallocated
+    columns (one array of doubles per field plus one of timestamps) used as a
+    ring buffer. The number of records kept is derived from max_bytes, so
+    memory use is fixed. Records must be appended in timestamp order, which
+    keeps the timestamp column sorted for binary searches. Missing or
+    non-numeric values are stored as NaN and returned as None.
+    """
+    def __init__(self, fields, max_bytes=1024 * 1024):
+        if not fields:
+            raise ValueError("At least one field is required")
+
+        self.fields = list(fields)
+        self.capacity = max_bytes // (_ITEM_SIZE * (len(self.fields) + 1))
+        if self.capacity < 1:
+            raise ValueError("max_bytes is too small for {0} fields".format(
+                len(self.fields)
+            ))
+
+        self._timestamps = array("d", bytes(_ITEM_SIZE * self.capacity))
+        self._columns = [array("d", bytes(_ITEM_SIZE * self.capacity))
+                         for _ in self.fields]
+        # Physical index of the oldest record
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _physical(self, i):
+        return (self._start + i) % self.capacity
+
+    def _timestamp(self, i):
+        return self._timestamps[self._physical(i)]
+
+    def append(self, timestamp, record):
+        """
+        Append a record, overwriting the oldest one if the store is full.
+        Returns False (and stores nothing) if timestamp is older than the
+        latest record.
+        """
+        if self._count and timestamp < self._timestamp(self._count - 1):
+            return False
+
+        if self._count < self.capacity:
+            pos = self._physical(self._count)
+            self._count += 1
+        else:
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+
+        self._timestamps[pos] = timestamp
+        for field, column in zip(self.fields, self._columns):
+            value = record.get(field)
+            try:
+                column[pos] = value
+            except TypeError:
+                column[pos] = math.nan
+
+        return True
+
+    def _bisect(self, timestamp):
+        """ Logical index of the first record at or after timestamp """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def _slice(self, column, lo, hi):
+        if lo >= hi:
+            return array("d")
+
+        first, last = self._physical(lo), self._physical(hi - 1) + 1
+        if first < last:
+            return column[first:last]
+
+        return column[first:] + column[:last]
+
+    def _result(self, lo, hi):
+        result = {"timestamp": self._slice(self._timestamps, lo, hi).tolist()}
+        for field, column in zip(self.fields, self._columns):
+            result[field] = [None if math.isnan(v) else v
+                             for v in self._slice(column, lo, hi)]
+
+        return result
+
+    def latest(self, n=1):
+        """
+        Return the latest n records as a dict of columns ("timestamp" and one
+        list per field), oldest first.
+        """
+        return self._result(max(self._count - n, 0), self._count)
+
+    def range(self, start=None, end=None):
+        """
+        Return the records with start <= timestamp < end as a dict of
+        columns. Either bound may be None.
+        """
+        lo = 0 if start is None else self._bisect(start)
+        hi = self._count if end is None else self._bisect(end)
+
+        return self._result(lo, max(lo, hi))
+
+    def downsample(self, bucket, start=None, end=None, aggregate="mean"):
+        """
+        Aggregate the records with start <= timestamp < end into buckets of
+        bucket seconds aligned to multiples of bucket. Returns a dict of
+        columns whose timestamps are the bucket starts; empty buckets are
+        omitted. Argument aggregate is one of "mean", "min", "max" and
+        "last".
+        """
+        if bucket <= 0:
+            raise ValueError("bucket must be positive")
+        if aggregate not in AGGREGATES:
+            raise ValueError("aggregate must be one of {0}".format(
+                ", ".join(AGGREGATES)
+            ))
+
+        records = self.range(start, end)
+        result = {name: [] for name in records}
+
+        begin = 0
+        timestamps = records["timestamp"]
+        while begin < len(timestamps):
+            key = math.floor(timestamps[begin] / bucket) * bucket
+            stop = begin
+            while stop < len(timestamps) and timestamps[stop] < key + bucket:
+                stop += 1
+
+            result["timestamp"].append(key)
+            for field in self.fields:
+                values = [v for v in records[field][begin:stop]
+                          if v is not None]
+                result[field].append(_aggregate(values, aggregate))
+
+            begin = stop
+
+        return result
+
+    def dump(self):
+        """
+        Return the records serialized as bytes, for restore().
+        """
+        header = json.dumps({"fields": self.fields,
+                             "count": self._count}).encode("utf-8")
+        chunks = [_HEADER.pack(len(header)), header]
+        for column in [self._timestamps] + self._columns:
+            chunks.append(self._slice(column, 0, self._count).tobytes())
+
+        return b"".join(chunks)
+
+    def restore(self, data):
+        """
+        Replace the records with those serialized by dump(). Returns False
+        (and keeps the records) if they were dumped with different fields.
+        Raises ValueError (and keeps the records) if data is truncated or
+        otherwise malformed.
+        """
+        try:
+            length, = _HEADER.unpack_from(data)
+        except struct.error:
+            raise ValueError("Snapshot is too short")
+
+        offset = _HEADER.size + length
+        header = json.loads(data[_HEADER.size:offset].decode("utf-8"))
+        if not isinstance(header, dict) or \
+                not isinstance(header.get("fields"), list) or \
+                not isinstance(header.get("count"), int) or \
+                header["count"] < 0:
+            raise ValueError("Snapshot header is malformed")
+        if header["fields"] != self.fields:
+            return False
+
+        count = header["count"]
+        expected = offset + _ITEM_SIZE * count * (len(self.fields) + 1)
+        if len(data) != expected:
+            raise ValueError("Snapshot of {0} records has {1} bytes instead "
+                             "of {2}".format(count, len(data), expected))
+
+        columns = []
+        for _ in range(len(self.fields) + 1):
+            column = array("d")
+            column.frombytes(data[offset:offset + _ITEM_SIZE * count])
+            columns.append(column)
+            offset += _ITEM_SIZE * count
+
+        timestamps = columns[0]
+        if any(timestamps[i] > timestamps[i + 1] for i in range(count - 1)):
+            raise ValueError("Snapshot timestamps are out of order")
+
+        # Keep the latest records if the capacity has shrunk
+        skip = max(count - self.capacity, 0)
+        self._start = 0
+        self._count = count - skip
+        for stored, column in zip([self._timestamps] + self._columns,
+                                  columns):
+            stored[:self._count] = column[skip:]
+
+        return True
+
+
+def _aggregate(values, aggregate):
+    if not values:
+        return None
+    if aggregate == "mean":
+        return sum(values) / len(values)
+    if aggregate == "min":
+        return min(values)
+    if aggregate == "max":
+        return max(values)
+
+    return values[-1]
@@ -0,0 +1,113 @@
+"""
+Per-message latency tracing
+
+A sampled message carries a trace context in meta.trace:
+
+    {"id": "...", "t0": <origin time>, "hops": [[node, enqueue, dequeue], ...]}
+
+Hop timestamps are seconds relative to t0. Wall-clock time is used rather
+than a monotonic clock so that hops recorded by other processes and agents
+(via ZMQ or docker containers) can be compared.
+"""
+import copy
+import time
+import uuid
+from logging import DEBUG, getLogger
+
+from . import metrics
+
+logger = getLogger(__name__)
+
+
+def start(meta):
+    """ Attach a new trace context to message metadata """
+    meta["trace"] = {
+        "id": uuid.uuid4().hex[:16],
+        "t0": time.time(),
+        "hops": []
+    }
+
+
+def get(data):
+    """ Return the trace context of a message, or None if untraced """
+    try:
+        return data["meta"]["trace"]
+    except (KeyError, TypeError, IndexError):
+        return None
+
+
+def _offset(trace):
+    return round(time.time() - trace["t0"], 6)
+
+
+def enqueued(trace, node):
+    """ Record that a message was queued at a node """
+    trace["hops"].append([node, _offset(trace), None])
+
+
+def dequeued(trace, node):
+    """
+    Record that a node started processing a message. The time the message
+    spent queued (trace.<node>.wait) and the time since the previous hop
+    started processing it (trace.<node>.transit) are recorded as metrics.
+    """
+    now = _offset(trace)
+    hops = trace["hops"]
+
+    if hops and hops[-1][0] == node and hops[-1][2] is None:
+        hops[-1][2] = now
+    else:
+        # Fused nodes receive messages without queueing
+        hops.append([node, now, now])
+
+    _observe_hop(hops, len(hops) - 1)
+
+
+def passed(trace, node):
+    """ Record that a message passed through a node without queueing """
+    now = _offset(trace)
+    trace["hops"].append([node, now, now])
+
+    _observe_hop(trace["hops"], len(trace["hops"]) - 1)
+
+
+def _observe_hop(hops, i):
+    name, enqueue, dequeue = hops[i]
+    previous = hops[i - 1][2] if i else 0.0
+
+    metrics.observe("trace.{0}.transit".format(name),
+                    enqueue - (previous or 0.0))
+    metrics.observe("trace.{0}.wait".format(name), dequeue - enqueue)
+
+
+def fork(data):
+    """
+    Return a copy of a traced message whose trace can be extended
+    independently, for delivering it to one of several nodes. Records stay
+    records.
+    """
+    copied = copy.copy(data)
+    meta = copied["meta"] = copy.copy(data["meta"])
+    trace = meta["trace"] = dict(meta["trace"])
+    trace["hops"] = [list(hop) for hop in trace["hops"]]
+
+    return copied
+
+
+def finish(trace, node):
+    """
+    Record the end-to-end latency of a message reaching a terminal node
+    (trace.<node>.total), and log its hops when debugging.
+    """
+    metrics.observe("trace.{0}.total".format(node), _offset(trace))
+
+    if logger.isEnabledFor(DEBUG):
+        logger.debug("Trace {0} reached node {1}: {2}".format(
+            trace["id"], node, " -> ".join(
+                "{0} (+{1:.1f}ms, {2:.1f}ms queued)".format(
+                    name, enqueue * 1000, (dequeue - enqueue) * 1000
+                )
+                for name, enqueue, dequeue in trace["hops"]
+                if dequeue is not None
+            )
+        ))
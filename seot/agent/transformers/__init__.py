@@ -1,26 +1,141 @@
+import asyncio
 from abc import abstractmethod
+from concurrent.futures import FIRST_EXCEPTION
+from logging import getLogger
 
-from ..sinks import BaseSink
+from .. import tracing
+from ..sinks import BaseSink, DownstreamUnavailable
 from ..sources import BaseSource
 
+logger = getLogger(__name__)
+
 
 class BaseTransformer(BaseSource, BaseSink):
+    _ends_traces = False
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    async def _invoke(self, data):
+        output_data = await super()._invoke(data)
+
+        # Carry the trace over to a newly created output message, replacing
+        # any trace the transformer started itself
+        if output_data is not None and output_data is not data:
+            trace = tracing.get(data)
+            if trace is not None:
+                if "meta" not in output_data:
+                    self._stamp_meta(output_data, sample=False)
+                output_data["meta"]["trace"] = trace
+
+        return output_data
+
 
 class SimpleTransformer(BaseTransformer):
-    def __init__(self, **kwargs):
+    def __init__(self, concurrency=1, ordered=True, reorder_window=None,
+                 **kwargs):
+        """
+        Initialize this transformer. Argument concurrency specifies the
+        number of _process() calls run concurrently. If ordered is True,
+        outputs are emitted in input order; at most reorder_window messages
+        (2 * concurrency by default) are processed or waiting to be emitted
+        at a time. Otherwise outputs are emitted as soon as they are ready.
+        """
         super().__init__(**kwargs)
+        # Downstream nodes whose _process() runs inside this node's task
+        self._fused = []
+
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.reorder_window = reorder_window or 2 * concurrency
 
     @abstractmethod
     async def _process(self, data):
         pass
 
-    async def _run(self):
+    def fuse(self, node):
+        """
+        Run node's _process() directly after this node's (and previously
+        fused nodes') _process() instead of passing messages through its
+        queue.
+        """
+        self._fused.append(node)
+
+    async def _handle(self, data):
+        stage = self
+        output_data = await self._invoke(data)
+
+        for next_stage in self._fused:
+            if output_data is None:
+                return
+            if "meta" not in output_data:
+                stage._stamp_meta(output_data)
+
+            stage = next_stage
+            try:
+                output_data = await stage._invoke(output_data)
+            except DownstreamUnavailable as e:
+                logger.error("Node {0} dropped a message: {1}".format(
+                    stage.name, e
+                ))
+                return
+
+        if output_data is not None and isinstance(stage, BaseSource):
+            await stage._emit(output_data)
+
+    async def _worker(self):
         while True:
+            await self._window.acquire()
             input_data = await self._queue.get()
-            output_data = await self._process(input_data)
 
-            if output_data is not None:
-                await self._emit(output_data)
+            seq = self._next_in
+            self._next_in += 1
+
+            output_data = await self._invoke(input_data)
+
+            if not self.ordered:
+                if output_data is not None:
+                    await self._emit(output_data)
+                self._window.release()
+                continue
+
+            self._reorder_buffer[seq] = output_data
+
+            # Emit every output which is next in line
+            async with self._emit_lock:
+                while self._next_out in self._reorder_buffer:
+                    output_data = self._reorder_buffer.pop(self._next_out)
+                    self._next_out += 1
+
+                    if output_data is not None:
+                        await self._emit(output_data)
+                    self._window.release()
+
+    async def _run_concurrently(self):
+        self._window = asyncio.Semaphore(self.reorder_window, loop=self.loop)
+        self._emit_lock = asyncio.Lock(loop=self.loop)
+        self._reorder_buffer = {}
+        self._next_in = 0
+        self._next_out = 0
+
+        workers = [asyncio.ensure_future(self._worker(), loop=self.loop)
+                   for _ in range(self.concurrency)]
+        try:
+            done, _ = await asyncio.wait(workers, loop=self.loop,
+                                         return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _run(self):
+        if self.concurrency > 1:
+            await self._run_concurrently()
+            return
+
+        while True:
+            input_data = await self._queue.get()
+            await self._handle(input_data)
@@ -0,0 +1,107 @@
+import hashlib
+import time
+from logging import getLogger
+
+from . import SimpleTransformer
+from ..blobs import Blob
+
+
+logger = getLogger(__name__)
+
+
+class DeadbandFilter(SimpleTransformer):
+    """
+    Drop messages whose fields have not changed meaningfully since the last
+    message passed downstream.
+
+    Argument fields maps a field name to its deadband thresholds, e.g.
+    {"temperature": {"abs": 0.5}, "pressure": {"rel": 0.01}}. A numeric field
+    has changed if it moved more than the absolute threshold or more than the
+    relative threshold (as a fraction of the last passed value). Binary fields
+    listed in binary_fields are compared by their size or by their hash,
+    depending on binary_check ("size" or "hash"). A message passes if any of
+    the watched fields has changed, or if no message has passed for
+    max_silence seconds.
+    """
+    def __init__(self, fields=None, binary_fields=None, binary_check="hash",
+                 max_silence=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fields = fields or {}
+        self.binary_fields = binary_fields or []
+        self.max_silence = max_silence
+
+        if binary_check not in ("hash", "size"):
+            raise ValueError("binary_check must be either hash or size")
+        self.binary_check = binary_check
+
+        self._last_values = {}
+        self._last_pass = None
+
+    def _digest(self, value):
+        if self.binary_check == "size":
+            return len(value)
+        if isinstance(value, Blob):
+            value = value.view()
+        return hashlib.sha1(value).digest()
+
+    def _numeric_changed(self, key, value, thresholds):
+        last = self._last_values.get(key)
+        if last is None:
+            return True
+
+        delta = abs(value - last)
+        if delta > thresholds.get("abs", float("inf")):
+            return True
+        if "rel" in thresholds and delta > abs(last) * thresholds["rel"]:
+            return True
+
+        return False
+
+    def _changed(self, data):
+        changed = False
+        updates = {}
+
+        for key, thresholds in self.fields.items():
+            value = data.get(key)
+            if not isinstance(value, (int, float)):
+                continue
+
+            if self._numeric_changed(key, value, thresholds or {}):
+                changed = True
+            updates[key] = value
+
+        for key in self.binary_fields:
+            value = data.get(key)
+            if not isinstance(value, (bytes, Blob)):
+                continue
+
+            digest = self._digest(value)
+            if digest != self._last_values.get(key):
+                changed = True
+            updates[key] = digest
+
+        return changed, updates
+
+    async def _process(self, data):
+        changed, updates = self._changed(data)
+        now = time.monotonic()
+
+        silent_too_long = (
+            self.max_silence is not None and
+            (self._last_pass is None or
+             now - self._last_pass >= self.max_silence)
+        )
+
+        if not changed and not silent_too_long:
+            return None
+
+        # Only remember values that were actually sent downstream, so that
+        # slow drifts eventually exceed the deadband
+        self._last_values.update(updates)
+        self._last_pass = now
+
+        return data
+
+    @classmethod
+    def can_run(cls):
+        return True
@@ -8,6 +8,7 @@ import docker
 import msgpack
 
 from . import BaseTransformer
+from .. import tracing
 from ..dpp import encode
 
 
@@ -159,6 +160,11 @@ class DockerTransformer(BaseTransformer):
 
             unpacker.feed(buf)
             for msg in unpacker:
+                # Containers which pass meta through keep the trace going
+                trace = tracing.get(msg)
+                if trace is not None:
+                    tracing.passed(trace, self.name)
+
                 await self._emit(msg)
 
     @classmethod
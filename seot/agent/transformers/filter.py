@@ -0,0 +1,79 @@
+from logging import getLogger
+
+from . import SimpleTransformer
+from .. import metrics
+from ..expressions import compile_expression, compile_projection
+
+logger = getLogger(__name__)
+
+
+class FilterTransformer(SimpleTransformer):
+    """
+    Filter and reshape messages with expressions (see seot.agent.expressions)
+    compiled when the graph definition is compiled.
+
+    Argument where is a predicate; messages for which it is false are
+    dropped. Argument select is either a list of fields to keep or a mapping
+    from output fields to expressions computing them, and drop lists fields
+    to remove. Metadata is always kept. Messages for which an expression
+    fails (e.g. comparing a missing field with a number) are dropped and
+    counted in node.<name>.errors.
+
+    Example args:
+
+        where: temperature > 30 and meta.agent_id == "..."
+        select:
+          temperature_f: temperature * 1.8 + 32
+          humidity: humidity
+    """
+    def __init__(self, where=None, select=None, drop=None, **kwargs):
+        super().__init__(**kwargs)
+        args = self.validate_args({"where": where, "select": select,
+                                   "drop": drop})
+        self.where = args["where"]
+        self.select = args["select"]
+        self.drop = args["drop"]
+        self._errors_metric = "node.{0}.errors".format(self.name)
+
+    @classmethod
+    def validate_args(cls, args):
+        args = dict(args)
+
+        if args.get("where") is not None:
+            args["where"] = compile_expression(args["where"])
+        if args.get("select") is not None:
+            args["select"] = compile_projection(args["select"])
+        if args.get("drop") is not None:
+            if not isinstance(args["drop"], (list, frozenset)):
+                raise ValueError("drop must be a list of field names")
+            args["drop"] = frozenset(args["drop"])
+
+        return args
+
+    async def _process(self, data):
+        try:
+            if self.where is not None and not self.where(data):
+                return None
+
+            if self.select is not None:
+                output_data = self.select(data)
+                if "meta" in data:
+                    output_data.setdefault("meta", data["meta"])
+            else:
+                output_data = data
+        except Exception as e:
+            metrics.incr(self._errors_metric)
+            logger.debug("Node {0} dropped a message: {1}".format(
+                self.name, e
+            ))
+            return None
+
+        if self.drop:
+            output_data = {key: value for key, value in output_data.items()
+                           if key not in self.drop}
+
+        return output_data
+
+    @classmethod
+    def can_run(cls):
+        return True
@@ -0,0 +1,133 @@
+from collections import deque
+from logging import getLogger
+
+from . import BaseTransformer
+from .. import metrics
+
+logger = getLogger(__name__)
+
+
+class JoinTransformer(BaseTransformer):
+    """
+    Merge messages from several upstream nodes whose meta.timestamp lie
+    within tolerance seconds of each other.
+
+    Argument inputs lists the names of the upstream nodes to join. Messages
+    of each input are buffered (at most buffer_size per input, dropping the
+    oldest), and a merged message is emitted as soon as every input has one
+    within the tolerance window, so output follows the slowest input. The
+    merged message maps each input name to its message (without meta), and
+    its meta.timestamp is the latest of the joined timestamps. Messages which
+    can no longer be joined, because they fall behind the watermark (the
+    timestamp of the last merged message) or behind the other inputs by more
+    than tolerance, are dropped and counted.
+    """
+    def __init__(self, inputs=None, tolerance=0.5, buffer_size=100,
+                 **kwargs):
+        super().__init__(**kwargs)
+
+        if not inputs or len(inputs) < 2:
+            raise ValueError("inputs must name at least two nodes")
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+
+        self.inputs = list(inputs)
+        self.tolerance = tolerance
+        self.buffer_size = buffer_size
+        self.watermark = None
+
+        # Input name -> deque of (timestamp, message)
+        self._buffers = {name: deque(maxlen=buffer_size)
+                         for name in self.inputs}
+        self._sender = None
+        self._metric_names = {
+            reason: "node.{0}.{1}".format(self.name, reason)
+            for reason in ("late", "unmatched", "evicted", "unknown_input")
+        }
+
+    async def _enqueue(self, data, sender):
+        await self._queue.put((sender, data))
+
+    def _drop(self, reason, count=1):
+        metrics.incr(self._metric_names[reason], count)
+
+    def _buffer(self, sender, data):
+        buf = self._buffers.get(sender)
+        if buf is None:
+            self._drop("unknown_input")
+            return
+
+        timestamp = data.get("meta", {}).get("timestamp")
+        if timestamp is None or \
+                (buf and timestamp < buf[-1][0]) or \
+                (self.watermark is not None and timestamp <= self.watermark):
+            self._drop("late")
+            return
+
+        if len(buf) == buf.maxlen:
+            self._drop("evicted")
+        buf.append((timestamp, data))
+
+    def _match(self):
+        buffers = self._buffers.values()
+
+        while all(buffers):
+            pivot = max(buf[0][0] for buf in buffers)
+
+            # Heads older than the window around the latest head cannot be
+            # joined with any message of that input
+            unmatched = 0
+            for buf in buffers:
+                while buf and buf[0][0] < pivot - self.tolerance:
+                    buf.popleft()
+                    unmatched += 1
+
+            if unmatched:
+                self._drop("unmatched", unmatched)
+                continue
+
+            # Every head lies within [pivot - tolerance, pivot]; take the
+            # latest message of each input not after pivot
+            matched = {}
+            for name, buf in self._buffers.items():
+                while len(buf) > 1 and buf[1][0] <= pivot:
+                    buf.popleft()
+                    self._drop("unmatched")
+                matched[name] = buf.popleft()[1]
+
+            return pivot, matched
+
+        return None, None
+
+    def _merge(self, timestamp, matched):
+        merged = {}
+        for name, data in matched.items():
+            merged[name] = {key: value for key, value in data.items()
+                            if key != "meta"}
+
+        self._stamp_meta(merged)
+        merged["meta"]["timestamp"] = timestamp
+
+        return merged
+
+    async def _process(self, data):
+        self._buffer(self._sender, data)
+
+        timestamp, matched = self._match()
+        if matched is None:
+            return None
+
+        self.watermark = timestamp
+        return self._merge(timestamp, matched)
+
+    async def _run(self):
+        while True:
+            self._sender, input_data = await self._queue.get()
+
+            output_data = await self._invoke(input_data)
+            if output_data is not None:
+                await self._emit(output_data)
+
+    @classmethod
+    def can_run(cls):
+        return True
@@ -1,31 +1,141 @@
+import collections.abc
+import random
+import zlib
+from bisect import bisect
 from itertools import cycle
-from logging import getLogger
+from logging import DEBUG, getLogger
 
 from . import BaseTransformer
-from .. import dpp
+from .. import dpp, metrics
 
 
 logger = getLogger(__name__)
 
 
+def _hash(value):
+    return zlib.crc32(str(value).encode("utf-8"))
+
+
 class LoadBalancer(BaseTransformer):
-    def __init__(self, **kwargs):
+    """
+    Distribute messages over the connected nodes.
+
+    Argument strategy selects how the destination is chosen:
+
+    - round_robin: cycle over the nodes
+    - weighted_round_robin: smooth weighted round robin using weights, a
+      mapping from node name to an integer weight (1 by default)
+    - least_queue: pick the node with the fewest queued messages, breaking
+      ties round robin
+    - power_of_two: pick the less loaded of two randomly chosen nodes
+    - consistent_hash: pick a node by consistent hashing of the message field
+      key (a dotted path such as "meta.agent_id"), so that messages with the
+      same key always go to the same node
+    """
+    STRATEGIES = ("round_robin", "weighted_round_robin", "least_queue",
+                  "power_of_two", "consistent_hash")
+
+    def __init__(self, strategy="round_robin", weights=None, key=None,
+                 replicas=64, **kwargs):
         super().__init__(**kwargs)
 
+        if strategy not in self.STRATEGIES:
+            raise ValueError("strategy must be one of {0}".format(
+                ", ".join(self.STRATEGIES)
+            ))
+        if strategy == "consistent_hash" and key is None:
+            raise ValueError("consistent_hash strategy requires key")
+
+        self.strategy = strategy
+        self.weights = weights or {}
+        self.key = key.split(".") if key else None
+        self.replicas = replicas
+        # Node name -> number of messages dispatched to it
+        self.dispatched = {}
+
     async def startup(self):
-        self._node_iterator = cycle(self.next_nodes())
+        nodes = self.next_nodes()
 
-    async def _process(self, data):
-        node = next(self._node_iterator)
+        self._node_iterator = cycle(nodes)
+        self._current_weights = [0] * len(nodes)
+        # Index of the node least_queue looks at first
+        self._least_queue_start = 0
 
-        logger.debug("Node {0} of type {1} emitted to node {2}:\n{3}".format(
-            self.name,
-            self.__class__.__name__,
-            node.name,
-            dpp.format(data))
+        self._ring = sorted((
+            (_hash("{0}#{1}".format(node.name, i)), node)
+            for node in nodes for i in range(self.replicas)),
+            key=lambda entry: entry[0]
         )
+        self._ring_keys = [h for h, _ in self._ring]
+
+        self._metric_names = {
+            node: "node.{0}.dispatch.{1}".format(self.name, node.name)
+            for node in nodes
+        }
+        for node in nodes:
+            self.dispatched[node.name] = 0
+
+        self._select = getattr(self, "_select_" + self.strategy)
+
+    def _select_round_robin(self, data):
+        return next(self._node_iterator)
+
+    def _select_weighted_round_robin(self, data):
+        nodes = self.next_nodes()
+        weights = [self.weights.get(node.name, 1) for node in nodes]
+
+        for i, weight in enumerate(weights):
+            self._current_weights[i] += weight
+
+        best = max(range(len(nodes)), key=self._current_weights.__getitem__)
+        self._current_weights[best] -= sum(weights)
+
+        return nodes[best]
+
+    def _select_least_queue(self, data):
+        nodes = self.next_nodes()
+        n = len(nodes)
+
+        # Scan from the node after the last pick so that ties (e.g. all
+        # queues empty) are broken round robin
+        start = self._least_queue_start
+        best = min(range(start, start + n),
+                   key=lambda i: nodes[i % n]._queue.qsize()) % n
+        self._least_queue_start = (best + 1) % n
+
+        return nodes[best]
+
+    def _select_power_of_two(self, data):
+        nodes = self.next_nodes()
+        if len(nodes) < 2:
+            return nodes[0]
+
+        a, b = random.sample(nodes, 2)
+        return a if a._queue.qsize() <= b._queue.qsize() else b
+
+    def _select_consistent_hash(self, data):
+        value = data
+        for component in self.key:
+            if not isinstance(value, collections.abc.Mapping):
+                value = None
+                break
+            value = value.get(component)
+
+        i = bisect(self._ring_keys, _hash(value)) % len(self._ring)
+        return self._ring[i][1]
+
+    async def _process(self, data):
+        node = self._select(data)
+
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Node {0} of type {1} emitted to node {2}:\n{3}"
+                         .format(self.name, self.__class__.__name__,
+                                 node.name, dpp.format(data)))
+
+        self.dispatched[node.name] += 1
+        metrics.incr(self._metric_names[node])
 
-        await node.write(data)
+        await node.write(data, sender=self.name)
 
     @classmethod
     def can_run(cls):
@@ -0,0 +1,86 @@
+"""
+Shared ZMQ context and in-process delivery between ZMQ nodes
+
+All ZMQ nodes of a process share one context (and thus one set of I/O
+threads). When a ZMQSink connects to an address bound by a ZMQSource of the
+same process, for example when two jobs of an agent are wired together over
+tcp://127.0.0.1, messages are handed over as objects instead of being
+encoded and sent through the kernel. Handed over messages are copied down to
+their metadata (see copy_message()), so that the receiving job cannot change
+the sender's messages; other values are shared.
+"""
+import copy
+from logging import getLogger
+
+import zmq.asyncio
+
+logger = getLogger(__name__)
+
+# Set to False to always send messages through ZMQ sockets
+handoff_enabled = True
+
+# Endpoint key -> ZMQSource bound to it
+_endpoints = {}
+
+_LOCAL_HOSTS = ("*", "0.0.0.0", "127.0.0.1", "localhost")
+
+
+def get_context():
+    """ Return the ZMQ context shared by all nodes of this process """
+    return zmq.asyncio.Context.instance()
+
+
+def endpoint_key(url):
+    """
+    Return a key identifying the endpoint of url. Wildcard and loopback TCP
+    addresses of the same port map to the same key.
+    """
+    scheme, _, address = url.partition("://")
+    if scheme == "tcp":
+        host, _, port = address.rpartition(":")
+        if host in _LOCAL_HOSTS:
+            return "tcp://*:" + port
+
+    return url
+
+
+def register(url, source):
+    """ Register a ZMQSource bound to url """
+    _endpoints[endpoint_key(url)] = source
+
+
+def unregister(url, source):
+    """ Unregister a ZMQSource bound to url """
+    key = endpoint_key(url)
+    if _endpoints.get(key) is source:
+        del _endpoints[key]
+
+
+def copy_message(data):
+    """
+    Return a copy of a message whose top-level keys, metadata and trace can
+    be changed without affecting data.
+    """
+    copied = copy.copy(data)
+
+    meta = copied.get("meta")
+    if meta is not None:
+        meta = copied["meta"] = copy.copy(meta)
+
+        trace = meta.get("trace")
+        if trace is not None:
+            trace = meta["trace"] = dict(trace)
+            trace["hops"] = [list(hop) for hop in trace["hops"]]
+
+    return copied
+
+
+def local_peer(key):
+    """
+    Return the ZMQSource of this process bound to the endpoint key, or None
+    if there is none or handoff is disabled.
+    """
+    if not handoff_enabled:
+        return None
+
+    return _endpoints.get(key)
@@ -1,4 +1,6 @@
 import argparse
+import hashlib
+import json
 import logging
 import logging.config
 
@@ -52,6 +54,13 @@ def log_quit_message():
     logger.info(farewell)
 
 
+def fingerprint(obj):
+    """ Return a stable digest of a JSON-serializable object """
+
+    encoded = json.dumps(obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
 def parse_cmd_args():
     global CONFIG_FILE_PATH, STATE_FILE_PATH
 
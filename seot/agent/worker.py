@@ -0,0 +1,468 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+from logging import getLogger
+
+from . import config, metrics
+
+logger = getLogger(__name__)
+
+
+class GraphWorker:
+    """
+    A dataflow graph running in a child process with its own event loop. It
+    exposes the same interface as Graph, so that it can be used in place of
+    one.
+    """
+    def __init__(self, graph_def, name="worker", loop=None, cpu_affinity=None,
+                 nice=None, metrics_interval=10, metrics_scope=None):
+        """
+        Initialize this worker. Argument graph_def is a graph definition
+        accepted by GraphBuilder.from_obj. Optionally, cpu_affinity (a list
+        of CPU numbers) and nice (a niceness increment) are applied to the
+        worker process. The worker reports its metrics every
+        metrics_interval seconds; the latest report is kept in
+        self.metrics and, if metrics_scope is given, merged into the metrics
+        of this process under names prefixed with it.
+        """
+        self.graph_def = graph_def
+        self.name = name
+        self.cpu_affinity = cpu_affinity
+        self.nice = nice
+        self.metrics_interval = metrics_interval
+        self.metrics_scope = metrics_scope
+        self.metrics = None
+
+        self.loop = loop
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        self._process = None
+        self._conn = None
+        self._call_ids = itertools.count()
+        self._pending = {}
+        self._running = False
+        self._done_cb = None
+        self._done_task = None
+
+    def nodes(self):
+        return []
+
+    def running(self):
+        """
+        Returns whether the graph in the worker process is running or not.
+        """
+        return self._running
+
+    def _options(self):
+        from .graph_builder import GraphBuilder
+
+        return {
+            "verbose": logging.getLogger().isEnabledFor(logging.DEBUG),
+            "registered_nodes": GraphBuilder.REGISTERED_NODES,
+            "cpu_affinity": self.cpu_affinity,
+            "nice": self.nice,
+            "metrics_interval": self.metrics_interval,
+            "name": self.name
+        }
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+
+        self._process = ctx.Process(
+            target=_worker_main,
+            args=(self.graph_def, child_conn, config.snapshot(),
+                  self._options()),
+            name="seot-{0}".format(self.name),
+            daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+
+        logger.info("Started worker {0} (pid {1})".format(
+            self.name, self._process.pid
+        ))
+
+        self.loop.add_reader(self._conn.fileno(), self._on_readable)
+
+    async def _call(self, command, *args):
+        if self._conn is None:
+            raise RuntimeError("Worker {0} is not alive".format(self.name))
+
+        call_id = next(self._call_ids)
+        future = self.loop.create_future()
+        self._pending[call_id] = future
+        self._conn.send((call_id, command, args))
+
+        return await future
+
+    def _on_readable(self):
+        try:
+            while self._conn.poll():
+                self._dispatch(self._conn.recv())
+        except (EOFError, OSError):
+            self._on_exit()
+
+    def _dispatch(self, msg):
+        kind = msg[0]
+
+        if kind == "reply":
+            _, call_id, error, result = msg
+            future = self._pending.pop(call_id, None)
+            if future is None or future.done():
+                return
+
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+        elif kind == "metrics":
+            self.metrics = msg[1]
+            if self.metrics_scope is not None:
+                metrics.merge(self.metrics, self.metrics_scope + ".")
+        elif kind == "done":
+            self._finish()
+
+    def _finish(self):
+        if not self._running:
+            return
+
+        self._running = False
+        if self._done_cb:
+            self._done_task = asyncio.ensure_future(self._done_cb(self),
+                                                    loop=self.loop)
+
+    def _on_exit(self):
+        self.loop.remove_reader(self._conn.fileno())
+        self._conn.close()
+        self._conn = None
+
+        if self._running:
+            logger.error("Worker {0} exited unexpectedly".format(self.name))
+
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(
+                    "Worker {0} exited".format(self.name)
+                ))
+        self._pending.clear()
+
+        self._finish()
+
+    async def startup(self):
+        """
+        Launch the worker process and initialize the graph in it.
+        """
+        self._spawn()
+
+        try:
+            await self._call("startup")
+        except Exception as e:
+            logger.error("Worker {0} failed to start: {1}".format(
+                self.name, e
+            ))
+            await self._terminate()
+            raise RuntimeError("Dataflow graph failed to start")
+
+    async def start(self, done_cb=None):
+        """
+        Start the graph in the worker process.
+        """
+        self._done_cb = done_cb
+        await self._call("start")
+        self._running = True
+
+    async def status(self):
+        """
+        Query the status of the worker process.
+        """
+        return await self._call("status")
+
+    async def stop(self):
+        """
+        Stop the graph in the worker process.
+        """
+        if not self._running:
+            return
+
+        await self._call("stop")
+
+        if self._done_task is not None:
+            await asyncio.wait([self._done_task], loop=self.loop)
+
+    async def cleanup(self):
+        """
+        Clean up the graph and terminate the worker process.
+        """
+        if self._conn is not None:
+            try:
+                await self._call("cleanup")
+            except Exception as e:
+                logger.warning("Failed to cleanup worker {0}: {1}".format(
+                    self.name, e
+                ))
+
+        if self._process is not None:
+            await self._terminate()
+
+    async def _terminate(self):
+        if self._conn is not None:
+            self.loop.remove_reader(self._conn.fileno())
+            try:
+                self._conn.send((None, "exit", ()))
+            except OSError:
+                pass
+            self._conn.close()
+            self._conn = None
+
+        await self.loop.run_in_executor(None, self._process.join, 5)
+        if self._process.is_alive():
+            logger.warning("Killing unresponsive worker {0}".format(
+                self.name
+            ))
+            self._process.terminate()
+
+        logger.info("Worker {0} exited with code {1}".format(
+            self.name, self._process.exitcode
+        ))
+        self._process = None
+
+
+class PartitionedGraph:
+    """
+    A dataflow graph split into partitions, each running in its own worker
+    process. It exposes the same interface as Graph.
+    """
+    def __init__(self, graph_defs, name="graph", loop=None, **kwargs):
+        """
+        Initialize this graph. Argument graph_defs is a list of graph
+        definitions, one per partition. Other keyword arguments are passed to
+        each GraphWorker.
+        """
+        self.loop = loop
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        self.workers = [
+            GraphWorker(graph_def, name="{0}-partition-{1}".format(name, i),
+                        loop=self.loop, **kwargs)
+            for i, graph_def in enumerate(graph_defs)
+        ]
+        self._done_cb = None
+        self._finished = False
+
+    def nodes(self):
+        return []
+
+    def running(self):
+        """
+        Returns whether any partition is running or not.
+        """
+        return any(worker.running() for worker in self.workers)
+
+    async def startup(self):
+        """
+        Launch worker processes and initialize each partition.
+        """
+        done, _ = await asyncio.wait(
+            [worker.startup() for worker in self.workers], loop=self.loop
+        )
+
+        if any(future.exception() for future in done):
+            await self.cleanup()
+            raise RuntimeError("Dataflow graph failed to start")
+
+    async def start(self, done_cb=None):
+        """
+        Start all partitions. When one partition stops, the others are
+        stopped as well.
+        """
+        self._done_cb = done_cb
+        self._finished = False
+
+        for worker in self.workers:
+            await worker.start(done_cb=self._on_worker_done)
+
+    async def _on_worker_done(self, worker):
+        # A partition alone cannot do anything useful, so stop the others
+        await self.stop()
+
+        if self.running() or self._finished:
+            return
+
+        self._finished = True
+        if self._done_cb:
+            await self._done_cb(self)
+
+    async def status(self):
+        """
+        Query the status of all partitions.
+        """
+        return [await worker.status() for worker in self.workers]
+
+    async def stop(self):
+        """
+        Stop all partitions.
+        """
+        running_workers = [w for w in self.workers if w.running()]
+        if not running_workers:
+            return
+
+        await asyncio.wait([worker.stop() for worker in running_workers],
+                           loop=self.loop)
+
+    async def cleanup(self):
+        """
+        Clean up all partitions and terminate worker processes.
+        """
+        await asyncio.wait([worker.cleanup() for worker in self.workers],
+                           loop=self.loop)
+
+
+class _WorkerServer:
+    """
+    Child side of GraphWorker. Executes commands received from the parent.
+    """
+    def __init__(self, graph_def, conn, loop, metrics_interval,
+                 monitor=None, name=None):
+        self.graph_def = graph_def
+        self.conn = conn
+        self.loop = loop
+        self.metrics_interval = metrics_interval
+        self.monitor = monitor
+        self.name = name
+        self.graph = None
+        self._exiting = False
+        self._report_task = None
+
+    def _send(self, msg):
+        try:
+            self.conn.send(msg)
+        except OSError:
+            pass
+
+    def on_readable(self):
+        try:
+            while self.conn.poll():
+                call_id, command, args = self.conn.recv()
+                if command == "exit":
+                    self._exiting = True
+                asyncio.ensure_future(self._handle(call_id, command, args),
+                                      loop=self.loop)
+        except (EOFError, OSError):
+            self.loop.remove_reader(self.conn.fileno())
+            if not self._exiting:
+                # The parent has gone away without asking us to exit
+                asyncio.ensure_future(self._shutdown(), loop=self.loop)
+
+    async def _handle(self, call_id, command, args):
+        handler = getattr(self, "_do_" + command, None)
+
+        result = None
+        error = None
+        try:
+            if handler is None:
+                raise ValueError("Unknown command {0}".format(command))
+            result = await handler(*args)
+        except Exception as e:
+            error = "{0}: {1}".format(e.__class__.__name__, e)
+
+        if call_id is not None:
+            self._send(("reply", call_id, error, result))
+
+    async def _on_done(self, graph):
+        if self._report_task is not None:
+            self._report_task.cancel()
+        self._send(("metrics", metrics.snapshot()))
+        self._send(("done", None))
+
+    async def _report_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval, loop=self.loop)
+            self._send(("metrics", metrics.snapshot()))
+
+    async def _do_startup(self):
+        from .graph_builder import GraphBuilder
+
+        self.graph = GraphBuilder.from_obj(self.graph_def, loop=self.loop)
+        if self.monitor is not None:
+            self.monitor.attribute(self.graph.nodes(), self.name)
+        await self.graph.startup()
+
+    async def _do_start(self):
+        await self.graph.start(done_cb=self._on_done)
+
+        if self.metrics_interval:
+            self._report_task = asyncio.ensure_future(self._report_metrics(),
+                                                      loop=self.loop)
+
+    async def _do_status(self):
+        return {
+            "pid": os.getpid(),
+            "running": self.graph is not None and self.graph.running(),
+            "metrics": metrics.snapshot()
+        }
+
+    async def _do_stop(self):
+        if self.graph.running():
+            await self.graph.stop()
+
+    async def _do_cleanup(self):
+        await self.graph.cleanup()
+
+    async def _do_exit(self):
+        if self.monitor is not None:
+            self.monitor.stop()
+        self.loop.call_soon(self.loop.stop)
+
+    async def _shutdown(self):
+        if self.graph is not None:
+            if self.graph.running():
+                await self.graph.stop()
+            await self.graph.cleanup()
+
+        if self.monitor is not None:
+            self.monitor.stop()
+        self.loop.stop()
+
+
+def _worker_main(graph_def, conn, snap, options):
+    import zmq.asyncio
+
+    from .graph_builder import GraphBuilder
+    from .loop_monitor import LoopMonitor
+    from .util import configure_logging
+
+    # The parent handles keyboard interrupts and stops us via the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    configure_logging(options["verbose"])
+    config.restore(snap)
+    GraphBuilder.REGISTERED_NODES = options["registered_nodes"]
+
+    if options["cpu_affinity"] and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, options["cpu_affinity"])
+    if options["nice"]:
+        os.nice(options["nice"])
+
+    loop = zmq.asyncio.install()
+
+    monitor = None
+    if config.get("loop_monitor.enabled"):
+        monitor = LoopMonitor(loop=loop,
+                              interval=config.get("loop_monitor.interval"),
+                              threshold=config.get("loop_monitor.threshold"))
+        monitor.start()
+
+    server = _WorkerServer(graph_def, conn, loop, options["metrics_interval"],
+                           monitor=monitor, name=options["name"])
+    loop.add_reader(conn.fileno(), server.on_readable)
+
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()